@@ -1,24 +1,2052 @@
 import json
 import os
+import sqlite3
 import random
 import threading
 import time
 import subprocess
 import shutil
+import hashlib
+import zipfile
+import uuid
+import re
+import select
+import zlib
+import struct
+import ctypes
+import ctypes.util
+from collections import OrderedDict, deque
 from datetime import datetime
+import itertools
+import queue
+from types import MappingProxyType
+import atexit
+import bisect
+import copy
+from array import array
 import platform
 import sys
-from flask import Flask, request, jsonify, render_template_string
+import argparse
+import urllib.request
+import urllib.error
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _make_crc32c_table():
+    """生成CRC32C（Castagnoli）查找表"""
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def crc32c(data, crc=0):
+    """计算CRC32C校验值"""
+    table = _CRC32C_TABLE
+    crc ^= 0xFFFFFFFF
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def link_or_copy(src, dst):
+    """尽量用硬链接复制文件，跨文件系统等情况退回普通复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def copy_server_file(src, dst):
+    """复制服务器目录时使用: 配置文件会被服务器原地改写，必须单独复制，程序和资源文件用硬链接"""
+    if src.endswith((".properties", ".json", ".txt")):
+        shutil.copy2(src, dst)
+    else:
+        link_or_copy(src, dst)
+
+
+def write_server_properties(properties, overrides):
+    """修改server.properties中的若干项；先写临时文件再替换，不会改到硬链接指向的原文件"""
+    overrides = dict(overrides)
+    lines = []
+    try:
+        with open(properties, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        pass
+
+    output = []
+    for line in lines:
+        key = line.split("=", 1)[0].strip()
+        if key in overrides:
+            output.append(f"{key}={overrides.pop(key)}")
+        else:
+            output.append(line)
+    output.extend(f"{key}={value}" for key, value in overrides.items())
+
+    tmp_file = properties + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(output) + "\n")
+    os.replace(tmp_file, properties)
+
+
+def read_varint(data, pos):
+    """读取LevelDB的varint32/varint64，返回(值, 新位置)"""
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint过长")
+
+
+class LevelDBLogReader:
+    """LevelDB预写日志(.log)的流式读取器：按32KiB块解析记录头、重组分片并校验CRC"""
+
+    BLOCK_SIZE = 32768
+    HEADER_SIZE = 7
+
+    ZERO_TYPE = 0
+    FULL_TYPE = 1
+    FIRST_TYPE = 2
+    MIDDLE_TYPE = 3
+    LAST_TYPE = 4
+
+    CRC_MASK_DELTA = 0xA282EAD8
+
+    def __init__(self, verify_checksums=True):
+        self.verify_checksums = verify_checksums
+        # 文件路径 -> {"inode": 索引节点, "offset": 下一条物理记录的位置, "fragments": 未完成的分片}
+        self.files = {}
+
+    def reset(self, path=None):
+        """清除某个文件（或全部文件）的读取进度"""
+        if path is None:
+            self.files.clear()
+        else:
+            self.files.pop(path, None)
+
+    def prune(self, existing_paths):
+        """丢弃已经被LevelDB删除的日志文件的读取进度"""
+        existing = set(existing_paths)
+        for path in list(self.files):
+            if path not in existing:
+                del self.files[path]
+
+    def _checksum_ok(self, masked_crc, record_type, payload):
+        rot = (masked_crc - self.CRC_MASK_DELTA) & 0xFFFFFFFF
+        expected = ((rot >> 17) | (rot << 15)) & 0xFFFFFFFF
+        return crc32c(payload, crc32c(bytes((record_type,)))) == expected
+
+    def read_records(self, path):
+        """逐条产出上次读取之后新写入的完整逻辑记录
+
+        读取进度在产出记录之前更新，调用方中途停止迭代也不会重复读取。
+        末尾写了一半的记录会留到下一次再读。
+        """
+        stat = os.stat(path)
+        state = self.files.get(path)
+
+        # 日志被轮换（inode变化）或被截断时从头开始
+        if state is None or state["inode"] != stat.st_ino or stat.st_size < state["offset"]:
+            state = {"inode": stat.st_ino, "offset": 0, "fragments": None}
+            self.files[path] = state
+
+        size = stat.st_size
+        pos = state["offset"]
+        if pos >= size:
+            return
+
+        with open(path, 'rb') as f:
+            while True:
+                block_left = self.BLOCK_SIZE - pos % self.BLOCK_SIZE
+
+                # 块尾不足一个记录头的部分是填充字节
+                if block_left < self.HEADER_SIZE:
+                    if pos + block_left > size:
+                        return
+                    pos += block_left
+                    state["offset"] = pos
+                    continue
+
+                f.seek(pos)
+                header = f.read(self.HEADER_SIZE)
+                if len(header) < self.HEADER_SIZE:
+                    return
+
+                masked_crc, length, record_type = struct.unpack('<IHB', header)
+
+                if record_type == self.ZERO_TYPE or self.HEADER_SIZE + length > block_left:
+                    # 预分配的零区域或损坏的记录头：丢弃本块剩余内容
+                    if pos + block_left > size:
+                        return
+                    pos += block_left
+                    state["offset"] = pos
+                    state["fragments"] = None
+                    continue
+
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+
+                end = pos + self.HEADER_SIZE + length
+                if self.verify_checksums and not self._checksum_ok(masked_crc, record_type, payload):
+                    # 恰好在文件末尾的校验失败可能是写入尚未完成，稍后重试
+                    if end >= size:
+                        return
+                    logger.warning(f"{path} 偏移 {pos} 处记录校验失败，跳过本块")
+                    pos += block_left
+                    state["offset"] = pos
+                    state["fragments"] = None
+                    continue
+
+                pos = end
+                state["offset"] = pos
+
+                if record_type == self.FULL_TYPE:
+                    state["fragments"] = None
+                    yield payload
+                elif record_type == self.FIRST_TYPE:
+                    state["fragments"] = [payload]
+                elif record_type == self.MIDDLE_TYPE:
+                    if state["fragments"] is not None:
+                        state["fragments"].append(payload)
+                elif record_type == self.LAST_TYPE:
+                    fragments = state["fragments"]
+                    state["fragments"] = None
+                    if fragments is not None:
+                        fragments.append(payload)
+                        yield b"".join(fragments)
+
+    @staticmethod
+    def parse_write_batch(record):
+        """解析WriteBatch，逐个产出(key, value)，删除操作的value为None"""
+        if len(record) < 12:
+            return
+
+        count = struct.unpack_from('<I', record, 8)[0]
+        pos = 12
+        try:
+            for _ in range(count):
+                tag = record[pos]
+                pos += 1
+
+                key_length, pos = read_varint(record, pos)
+                key = record[pos:pos + key_length]
+                pos += key_length
+
+                if tag == 1:
+                    value_length, pos = read_varint(record, pos)
+                    value = record[pos:pos + value_length]
+                    pos += value_length
+                    yield key, value
+                elif tag == 0:
+                    yield key, None
+                else:
+                    return
+        except (IndexError, ValueError):
+            return
+
+    def read_entries(self, path):
+        """逐个产出日志中新写入的(key, value)"""
+        for record in self.read_records(path):
+            yield from self.parse_write_batch(record)
+
+
+class NBTInventoryScanner:
+    """小端NBT的定向解析器：只遍历玩家记录中的背包列表，不构建完整的树"""
+
+    TAG_END = 0
+    TAG_BYTE = 1
+    TAG_SHORT = 2
+    TAG_INT = 3
+    TAG_LONG = 4
+    TAG_FLOAT = 5
+    TAG_DOUBLE = 6
+    TAG_BYTE_ARRAY = 7
+    TAG_STRING = 8
+    TAG_LIST = 9
+    TAG_COMPOUND = 10
+    TAG_INT_ARRAY = 11
+    TAG_LONG_ARRAY = 12
+
+    FIXED_SIZES = {TAG_BYTE: 1, TAG_SHORT: 2, TAG_INT: 4, TAG_LONG: 8, TAG_FLOAT: 4, TAG_DOUBLE: 8}
+
+    INVENTORY_LISTS = (b"Inventory", b"EnderChestInventory")
+
+    def __init__(self, data):
+        self.data = data
+
+    def _read_name(self, pos):
+        """返回(名称起点, 名称长度, 新位置)，不复制名称"""
+        length = struct.unpack_from('<H', self.data, pos)[0]
+        return pos + 2, length, pos + 2 + length
+
+    def _name_equals(self, start, length, name):
+        return length == len(name) and self.data[start:start + length] == name
+
+    def _skip_payload(self, tag_type, pos):
+        """跳过一个标签的负载，返回新位置"""
+        size = self.FIXED_SIZES.get(tag_type)
+        if size is not None:
+            return pos + size
+
+        if tag_type == self.TAG_STRING:
+            return pos + 2 + struct.unpack_from('<H', self.data, pos)[0]
+        if tag_type == self.TAG_BYTE_ARRAY:
+            return pos + 4 + struct.unpack_from('<i', self.data, pos)[0]
+        if tag_type == self.TAG_INT_ARRAY:
+            return pos + 4 + 4 * struct.unpack_from('<i', self.data, pos)[0]
+        if tag_type == self.TAG_LONG_ARRAY:
+            return pos + 4 + 8 * struct.unpack_from('<i', self.data, pos)[0]
+
+        if tag_type == self.TAG_LIST:
+            element_type = self.data[pos]
+            count = struct.unpack_from('<i', self.data, pos + 1)[0]
+            pos += 5
+            element_size = self.FIXED_SIZES.get(element_type)
+            if element_size is not None:
+                return pos + element_size * max(count, 0)
+            for _ in range(count):
+                pos = self._skip_payload(element_type, pos)
+            return pos
+
+        if tag_type == self.TAG_COMPOUND:
+            while True:
+                child_type = self.data[pos]
+                pos += 1
+                if child_type == self.TAG_END:
+                    return pos
+                _, _, pos = self._read_name(pos)
+                pos = self._skip_payload(child_type, pos)
+
+        raise ValueError(f"未知的NBT标签类型: {tag_type}")
+
+    def _item_matches(self, pos, item_name):
+        """检查一个物品复合标签，返回(是否为目标物品且数量大于0, 新位置)"""
+        name_matches = False
+        count = 1
+        while True:
+            child_type = self.data[pos]
+            pos += 1
+            if child_type == self.TAG_END:
+                return name_matches and count > 0, pos
+
+            name_start, name_length, pos = self._read_name(pos)
+
+            if child_type == self.TAG_STRING and self._name_equals(name_start, name_length, b"Name"):
+                value_start, value_length, pos = self._read_name(pos)
+                name_matches = self._name_equals(value_start, value_length, item_name)
+            elif child_type == self.TAG_BYTE and self._name_equals(name_start, name_length, b"Count"):
+                count = self.data[pos]
+                pos += 1
+            else:
+                pos = self._skip_payload(child_type, pos)
+
+    def _list_contains(self, pos, item_name):
+        """检查背包列表中是否有目标物品"""
+        element_type = self.data[pos]
+        count = struct.unpack_from('<i', self.data, pos + 1)[0]
+        pos += 5
+        if element_type != self.TAG_COMPOUND:
+            return False
+
+        for _ in range(count):
+            matches, pos = self._item_matches(pos, item_name)
+            if matches:
+                return True
+        return False
+
+    def find_item(self, item_name):
+        """只遍历根复合标签下的背包列表，其余字段整段跳过"""
+        if self.data[0] != self.TAG_COMPOUND:
+            return False
+        _, _, pos = self._read_name(1)
+
+        while True:
+            child_type = self.data[pos]
+            pos += 1
+            if child_type == self.TAG_END:
+                return False
+
+            name_start, name_length, pos = self._read_name(pos)
+            if child_type == self.TAG_LIST and any(
+                    self._name_equals(name_start, name_length, name) for name in self.INVENTORY_LISTS):
+                if self._list_contains(pos, item_name):
+                    return True
+            pos = self._skip_payload(child_type, pos)
+
+    @classmethod
+    def contains_item(cls, data, item_name):
+        """玩家记录的背包或末影箱里是否有指定物品，记录损坏时返回False"""
+        try:
+            return cls(data).find_item(item_name)
+        except (IndexError, ValueError, struct.error):
+            return False
+
+
+class CorruptTableError(ValueError):
+    """表的footer完整但数据块损坏（越界、校验失败、无法解压）"""
+
+
+class SSTableReader:
+    """LevelDB SSTable(.ldb)读取器：解析footer、索引块和数据块，支持Bedrock的zlib压缩"""
+
+    FOOTER_SIZE = 48
+    TABLE_MAGIC = 0xDB4775248B80FB57
+    BLOCK_TRAILER_SIZE = 5
+
+    NO_COMPRESSION = 0
+    SNAPPY_COMPRESSION = 1
+    ZLIB_COMPRESSION = 2
+    ZLIB_RAW_COMPRESSION = 4
+
+    VALUE_TYPE_DELETION = 0
+    VALUE_TYPE_VALUE = 1
+
+    def __init__(self, verify_checksums=False):
+        # 与LevelDB默认的ReadOptions一致，表数据块默认不校验CRC
+        self.verify_checksums = verify_checksums
+        # 已完整扫描过的表: 文件路径 -> (inode, 文件大小)
+        self.scanned = {}
+
+    def reset(self, path=None):
+        """清除某个表（或全部表）的扫描记录"""
+        if path is None:
+            self.scanned.clear()
+        else:
+            self.scanned.pop(path, None)
+
+    def mark_scanned(self, path):
+        """把表记为已扫描（损坏的表不再反复读取）"""
+        stat = os.stat(path)
+        self.scanned[path] = (stat.st_ino, stat.st_size)
+
+    def prune(self, existing_paths):
+        """丢弃已经被压缩删除的表"""
+        existing = set(existing_paths)
+        for path in list(self.scanned):
+            if path not in existing:
+                self.reset(path)
+
+    @staticmethod
+    def _read_handle(data, pos):
+        offset, pos = read_varint(data, pos)
+        size, pos = read_varint(data, pos)
+        return (offset, size), pos
+
+    @classmethod
+    def _iter_block(cls, block):
+        """遍历块内的前缀压缩条目，产出(key, value)"""
+        try:
+            yield from cls._iter_block_entries(block)
+        except (IndexError, ValueError, struct.error) as e:
+            raise CorruptTableError(f"数据块格式错误: {e}") from e
+
+    @staticmethod
+    def _iter_block_entries(block):
+        num_restarts = struct.unpack_from('<I', block, len(block) - 4)[0]
+        limit = len(block) - 4 - 4 * num_restarts
+
+        pos = 0
+        key = b""
+        while pos < limit:
+            shared, pos = read_varint(block, pos)
+            non_shared, pos = read_varint(block, pos)
+            value_length, pos = read_varint(block, pos)
+
+            key = key[:shared] + block[pos:pos + non_shared]
+            pos += non_shared
+            value = block[pos:pos + value_length]
+            pos += value_length
+
+            yield key, value
+
+    def _read_block(self, f, handle):
+        """读取并解压一个块"""
+        offset, size = handle
+
+        f.seek(offset)
+        raw = f.read(size + self.BLOCK_TRAILER_SIZE)
+        if len(raw) < size + self.BLOCK_TRAILER_SIZE:
+            raise CorruptTableError(f"数据块越界: 偏移 {offset}")
+
+        data = raw[:size]
+        compression = raw[size]
+
+        if self.verify_checksums:
+            masked_crc = struct.unpack_from('<I', raw, size + 1)[0]
+            rot = (masked_crc - LevelDBLogReader.CRC_MASK_DELTA) & 0xFFFFFFFF
+            expected = ((rot >> 17) | (rot << 15)) & 0xFFFFFFFF
+            if crc32c(raw[:size + 1]) != expected:
+                raise CorruptTableError(f"数据块校验失败: 偏移 {offset}")
+
+        try:
+            if compression == self.NO_COMPRESSION:
+                return data
+            if compression == self.ZLIB_COMPRESSION:
+                return zlib.decompress(data)
+            if compression == self.ZLIB_RAW_COMPRESSION:
+                return zlib.decompress(data, -15)
+        except zlib.error as e:
+            raise CorruptTableError(f"数据块解压失败: 偏移 {offset}: {e}") from e
+        raise CorruptTableError(f"不支持的压缩类型: {compression}")
+
+    def read_entries(self, path):
+        """按顺序产出表中全部条目(user_key, value)，删除标记的value为None"""
+        stat = os.stat(path)
+        if stat.st_size < self.FOOTER_SIZE:
+            raise ValueError("文件过小，表可能尚未写完")
+
+        with open(path, 'rb') as f:
+            f.seek(stat.st_size - self.FOOTER_SIZE)
+            footer = f.read(self.FOOTER_SIZE)
+
+            magic = struct.unpack_from('<Q', footer, self.FOOTER_SIZE - 8)[0]
+            if magic != self.TABLE_MAGIC:
+                raise ValueError("footer魔数不匹配，表可能尚未写完")
+
+            _metaindex_handle, pos = self._read_handle(footer, 0)
+            index_handle, _ = self._read_handle(footer, pos)
+
+            index_block = self._read_block(f, index_handle)
+            for _, handle_bytes in self._iter_block(index_block):
+                try:
+                    data_handle, _ = self._read_handle(handle_bytes, 0)
+                except (IndexError, ValueError) as e:
+                    raise CorruptTableError(f"索引条目格式错误: {e}") from e
+                data_block = self._read_block(f, data_handle)
+
+                for internal_key, value in self._iter_block(data_block):
+                    if len(internal_key) < 8:
+                        continue
+                    value_type = internal_key[-8]
+                    user_key = internal_key[:-8]
+                    if value_type == self.VALUE_TYPE_VALUE:
+                        yield user_key, value
+                    elif value_type == self.VALUE_TYPE_DELETION:
+                        yield user_key, None
+
+    def read_new_entries(self, path):
+        """只扫描尚未扫描过的表；表文件写入后不再变化，每张表只需完整扫描一次"""
+        stat = os.stat(path)
+        signature = (stat.st_ino, stat.st_size)
+        if self.scanned.get(path) == signature:
+            return
+
+        yield from self.read_entries(path)
+        self.scanned[path] = signature
+
+
+class ServerOutputPump:
+    """持续读取服务器stdout/stderr，解析后存入固定容量的环形缓冲区"""
+
+    LINE_PATTERN = re.compile(r"^\[(?P<timestamp>[\d\-:. ]+?)\s+(?P<level>[A-Z]+)\]\s?(?P<text>.*)$")
+
+    def __init__(self, capacity=2000):
+        self.lines = deque(maxlen=capacity)
+        self.next_id = 1
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def attach(self, process):
+        """为新启动的服务器进程启动stdout/stderr读取线程"""
+        for stream, name in ((process.stdout, "stdout"), (process.stderr, "stderr")):
+            if stream is not None:
+                threading.Thread(target=self._pump, args=(stream, name), daemon=True).start()
+
+    def _pump(self, stream, name):
+        try:
+            for raw in stream:
+                self.append(name, raw.rstrip("\r\n"))
+        except (OSError, ValueError):
+            pass
+
+    def append(self, stream_name, raw):
+        """解析一行输出并写入缓冲区，然后通知监听者"""
+        match = self.LINE_PATTERN.match(raw)
+        if match:
+            level = match.group("level")
+            text = match.group("text")
+        else:
+            level = "ERROR" if stream_name == "stderr" else "INFO"
+            text = raw
+        self._store(stream_name, level, text)
+
+    def relay_to(self, target):
+        """把已缓存的行和之后的新行都转发到另一个缓冲区（预热服务器接管时使用）"""
+        with self.lock:
+            buffered = list(self.lines)
+            self.listeners.append(lambda entry: target._store(entry["stream"], entry["level"], entry["message"]))
+        for entry in buffered:
+            target._store(entry["stream"], entry["level"], entry["message"])
+
+    def _store(self, stream_name, level, text):
+        with self.lock:
+            entry = {
+                "id": self.next_id,
+                "time": datetime.now().strftime("%H:%M:%S"),
+                "stream": stream_name,
+                "level": level,
+                "message": text
+            }
+            self.next_id += 1
+            self.lines.append(entry)
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            try:
+                listener(entry)
+            except Exception as e:
+                logger.warning(f"服务器输出监听器出错: {e}")
+
+    def get_lines(self, since=0):
+        """返回id大于since的行，只遍历新增部分"""
+        with self.lock:
+            if not self.lines:
+                return []
+            first_id = self.lines[0]["id"]
+            start = max(0, since - first_id + 1)
+            return list(itertools.islice(self.lines, start, None))
+
+    def last_id(self):
+        with self.lock:
+            return self.next_id - 1
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+
+class EventSubscription(queue.Queue):
+    """一个SSE连接的有界事件队列；closed 为True表示已被断开，连接应尽快结束让浏览器重连补发"""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.closed = False
+        # 已放入队列、连接线程尚未取走的变化通知
+        self.notices = set()
+
+
+class EventBroadcaster:
+    """把事件推送给任意数量的订阅者（SSE连接），每个订阅者一个有界队列"""
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = EventSubscription(self.queue_size)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event, data, event_id=None):
+        """推送一个事件；队列已满的订阅者（客户端太慢或已断开）直接移除，由浏览器重连补发"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data, event_id))
+            except queue.Full:
+                self.disconnect(subscriber)
+
+    def notify(self, event):
+        """通知订阅者某类状态已变化；尚未取走的同类通知只保留一个，内容由连接线程取走时再生成"""
+        with self.lock:
+            targets = [subscriber for subscriber in self.subscribers if event not in subscriber.notices]
+            for subscriber in targets:
+                subscriber.notices.add(event)
+
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait((event, None, None))
+            except queue.Full:
+                self.disconnect(subscriber)
+
+    def take_notice(self, subscriber, event):
+        """连接线程取走通知；之后再发生的变化会放入新的通知"""
+        with self.lock:
+            subscriber.notices.discard(event)
+
+    def disconnect(self, subscriber):
+        """断开跟不上的订阅者: 标记关闭，清空队列后放入结束标记唤醒等待中的连接"""
+        subscriber.closed = True
+        self.unsubscribe(subscriber)
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            # 其他线程又塞满了队列；连接取到下一项时会检查 closed
+            pass
+
+
+class ConsoleItemDetector:
+    """通过bedrock_server控制台查询玩家背包的检测后端，不读取世界数据库"""
+
+    COUNT_PATTERN = re.compile(r"has (\d+) items? that match")
+
+    def __init__(self, process, output_pump, item_name):
+        self.process = process
+        self.output_pump = output_pump
+        self.item_name = item_name
+        self.detected = threading.Event()
+
+    def start(self):
+        """订阅服务器控制台输出"""
+        self.output_pump.add_listener(self._on_line)
+
+    def stop(self):
+        """取消订阅"""
+        self.output_pump.remove_listener(self._on_line)
+
+    def _on_line(self, entry):
+        match = self.COUNT_PATTERN.search(entry["message"])
+        if match and int(match.group(1)) > 0:
+            self.detected.set()
+
+    def query(self, timeout):
+        """发送一次查询并等待回复，返回是否有玩家持有目标物品"""
+        if self.detected.is_set():
+            return True
+
+        try:
+            # 最大数量为0时clear只统计数量，不会真的清除物品
+            self.process.stdin.write(f"clear @a {self.item_name} 0 0\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            logger.warning(f"向服务器控制台发送查询失败: {e}")
+
+        return self.detected.wait(timeout)
+
+
+class WorldSnapshotCache:
+    """按(种子, 资源包, 服务器版本)缓存刚生成的世界，压缩存储并按LRU淘汰
+
+    只保存世界数据（db、level.dat等），资源包由部署流程负责，快照中不包含。
+    """
+
+    PACK_ENTRIES = ("behavior_packs", "resource_packs", "world_behavior_packs.json", "world_resource_packs.json")
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+        self._load_index()
+
+    @staticmethod
+    def make_key(seed, drop_rate_tier, server_version, pack_hash):
+        # 资源包内容（掉率规则、战利品表等）变化后旧快照不再命中
+        return hashlib.sha1(f"{seed}|{drop_rate_tier}|{server_version}|{pack_hash}".encode("utf-8")).hexdigest()
+
+    def _archive_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    @classmethod
+    def is_pack_entry(cls, rel_path):
+        return rel_path.replace("\\", "/").split("/", 1)[0] in cls.PACK_ENTRIES
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                # 只保留压缩包仍然存在的条目
+                self.index = {k: v for k, v in data.items()
+                              if isinstance(v, dict) and os.path.exists(self._archive_path(k))}
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.index_file)
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.index
+
+    def restore(self, key, target_dir):
+        """把缓存的世界解压到目标目录，未命中返回False"""
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return False
+            entry["last_used"] = time.time()
+            self._save_index()
+
+        try:
+            with zipfile.ZipFile(self._archive_path(key)) as archive:
+                # 不覆盖刚部署好的资源包
+                archive.extractall(target_dir, [name for name in archive.namelist() if not self.is_pack_entry(name)])
+            return True
+        except (OSError, zipfile.BadZipFile) as e:
+            logger.warning(f"世界快照损坏，已丢弃: {e}")
+            self.discard(key)
+            return False
+
+    def store(self, key, source_dir, meta):
+        """把世界目录压缩进缓存，然后按LRU淘汰到预算以内"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        archive_path = self._archive_path(key)
+        tmp_path = archive_path + ".tmp"
+
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for root, dirs, files in os.walk(source_dir):
+                if root == source_dir:
+                    dirs[:] = [name for name in dirs if not self.is_pack_entry(name)]
+                for name in files:
+                    file_path = os.path.join(root, name)
+                    rel_path = os.path.relpath(file_path, source_dir)
+                    if not self.is_pack_entry(rel_path):
+                        archive.write(file_path, rel_path)
+        os.replace(tmp_path, archive_path)
+
+        with self.lock:
+            self.index[key] = dict(meta, size=os.path.getsize(archive_path), last_used=time.time())
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        """删除最久未使用的快照直到总大小不超过预算"""
+        total = sum(entry.get("size", 0) for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(key).get("size", 0)
+            try:
+                os.remove(self._archive_path(key))
+            except OSError:
+                pass
+
+    def discard(self, key):
+        with self.lock:
+            self.index.pop(key, None)
+            self._save_index()
+        try:
+            os.remove(self._archive_path(key))
+        except OSError:
+            pass
+
+
+class ResourceDeployer:
+    """按内容哈希增量部署资源包：只复制与目标不同的文件，优先使用reflink"""
+
+    FICLONE = 0x40049409
+
+    def __init__(self, link_mode="auto"):
+        # "auto": 先尝试reflink，不支持时复制; "hardlink": 硬链接，失败时复制; "copy": 总是复制
+        self.link_mode = link_mode
+        self.reflink_supported = fcntl is not None
+        # 资源目录 -> {相对路径: {"size", "mtime_ns", "sha1"}}
+        self.manifests = {}
+        # 部署目标 -> {相对路径: (sha1, size, mtime_ns)}，记录上次放进去的文件，未被改动时不必重新计算哈希
+        self.deployed = OrderedDict()
+        self.max_deployed_targets = 32
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def manifest(self, source_dir):
+        """返回资源目录的哈希清单；只有大小或修改时间变化的文件才重新计算哈希"""
+        with self.lock:
+            old = self.manifests.get(source_dir, {})
+            new = {}
+            for root, _, files in os.walk(source_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    rel_path = os.path.relpath(path, source_dir)
+                    stat = os.stat(path)
+                    entry = old.get(rel_path)
+                    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": self._hash_file(path)}
+                    new[rel_path] = entry
+            self.manifests[source_dir] = new
+            return new
+
+    def content_hash(self, source_dir):
+        """资源目录内容的哈希，由清单中各文件的哈希组合而成"""
+        manifest = self.manifest(source_dir)
+        return hashlib.sha1(json.dumps(
+            sorted((path, entry["sha1"]) for path, entry in manifest.items())).encode("utf-8")).hexdigest()[:16]
+
+    def _reflink(self, src, dst):
+        """在支持的文件系统上做写时复制克隆"""
+        if not self.reflink_supported:
+            return False
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return True
+        except OSError:
+            # 同一台机器上的文件系统一般不会变化，失败一次后不再尝试
+            self.reflink_supported = False
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            return False
+
+    def _place(self, src, dst):
+        if self.link_mode == "hardlink":
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        elif self.link_mode == "auto" and self._reflink(src, dst):
+            return
+        shutil.copy2(src, dst)
+
+    def _is_current(self, dst, entry, record):
+        """目标文件是否已是清单中的内容: 与上次部署记录的大小和修改时间一致时直接信任，否则计算哈希"""
+        try:
+            stat = os.stat(dst)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if record is not None and record == (entry["sha1"], stat.st_size, stat.st_mtime_ns):
+            return True
+        return self._hash_file(dst) == entry["sha1"]
+
+    def deploy(self, source_dir, target_dir):
+        """把资源部署到目标目录，返回(复制数, 跳过数, 删除数, 错误列表)"""
+        manifest = self.manifest(source_dir)
+        copied = skipped = removed = 0
+        errors = []
+
+        target_key = os.path.abspath(target_dir)
+        with self.lock:
+            records = self.deployed.pop(target_key, {})
+        # 新建或刚清空的世界目录里没有旧文件，不需要逐个比对
+        fresh = not os.path.isdir(target_dir) or not os.listdir(target_dir)
+        deployed = {}
+
+        for rel_path, entry in manifest.items():
+            if rel_path == "build_manifest.json":
+                continue
+            src = os.path.join(source_dir, rel_path)
+            dst = os.path.join(target_dir, rel_path)
+            try:
+                if not fresh and self._is_current(dst, entry, records.get(rel_path)):
+                    skipped += 1
+                else:
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    if not fresh and os.path.lexists(dst):
+                        os.remove(dst)
+                    self._place(src, dst)
+                    copied += 1
+                stat = os.stat(dst)
+                deployed[rel_path] = (entry["sha1"], stat.st_size, stat.st_mtime_ns)
+            except Exception as e:
+                errors.append(f"{rel_path}: {e}")
+
+        with self.lock:
+            self.deployed[target_key] = deployed
+            while len(self.deployed) > self.max_deployed_targets:
+                self.deployed.popitem(last=False)
+
+        if fresh:
+            return copied, skipped, removed, errors
+
+        # 资源包目录中不属于清单的旧文件要删掉，与原来整个目录重新复制的效果一致
+        for item in os.listdir(source_dir):
+            target_item = os.path.join(target_dir, item)
+            if not os.path.isdir(os.path.join(source_dir, item)) or not os.path.isdir(target_item):
+                continue
+            for root, _, files in os.walk(target_item):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if os.path.relpath(path, target_dir) not in manifest:
+                        try:
+                            os.remove(path)
+                            removed += 1
+                        except OSError as e:
+                            errors.append(f"{path}: {e}")
+
+        return copied, skipped, removed, errors
+
+
+class UnknownDropRateTierError(ValueError):
+    """drop_rate_tiers.json 中没有定义的掉率档位"""
+
+
+class DropRatePackBuilder:
+    """由服务器自带的原版战利品表和声明式掉率规则生成各档掉率资源包，按输入哈希缓存，单个文件变化时增量重建
+
+    每个档位都是"原版表 + 本档规则"，档位之间不叠加；extends 只是合并规则声明。
+    """
+
+    TRANSFORM_DIRS = ("loot_tables", "trading")
+
+    def __init__(self, deployer, base_dir, tiers_file, cache_dir, server_dir):
+        self.deployer = deployer
+        self.base_dir = base_dir
+        self.tiers_file = tiers_file
+        self.cache_dir = cache_dir
+        self.server_dir = server_dir
+        self.tiers_config = {}
+        self.tiers_mtime = None
+        self.lock = threading.Lock()
+
+    def load_tiers(self):
+        """读取掉率档位定义，文件未变化时直接使用缓存"""
+        try:
+            mtime = os.path.getmtime(self.tiers_file)
+        except OSError:
+            self.tiers_config = {}
+            self.tiers_mtime = None
+            return self.tiers_config
+
+        if mtime != self.tiers_mtime:
+            with open(self.tiers_file, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            self.tiers_config = config if isinstance(config, dict) else {}
+            self.tiers_mtime = mtime
+        return self.tiers_config
+
+    def tier_names(self):
+        return list(self.load_tiers().get("tiers", {}))
+
+    def default_tier(self):
+        return self.load_tiers().get("default_tier", "increased")
+
+    def tier_rules(self, tier, _seen=()):
+        """合并 extends 后的档位规则 {"tables": {表路径: 表规则}, "items": {物品: 规则}}"""
+        tiers = self.load_tiers().get("tiers", {})
+        if tier not in tiers:
+            raise UnknownDropRateTierError(f"未知的掉率档位: {tier}（可用: {', '.join(tiers) or '无'}）")
+        if tier in _seen:
+            raise ValueError(f"掉率档位循环继承: {' -> '.join(_seen + (tier,))}")
+
+        declared = tiers[tier] or {}
+        if not {"tables", "items", "extends"} & set(declared):
+            # 旧格式: 整个档位就是物品规则
+            declared = {"items": declared}
+
+        rules = {"tables": {}, "items": {}}
+        if declared.get("extends"):
+            rules = self.tier_rules(declared["extends"], _seen + (tier,))
+        for name, table_rule in declared.get("tables", {}).items():
+            rules["tables"][name] = dict(rules["tables"].get(name, {}), **table_rule)
+        for name, item_rule in declared.get("items", {}).items():
+            rules["items"][name] = dict(rules["items"].get(name, {}), **item_rule)
+        return rules
+
+    def base_layers(self):
+        """服务器的原版行为包目录，按版本从旧到新排列，新版本的同名表覆盖旧版本"""
+        packs_dir = os.path.join(self.server_dir, self.load_tiers().get("base_packs", "behavior_packs"))
+        layers = []
+        try:
+            names = os.listdir(packs_dir)
+        except OSError:
+            return []
+        for name in names:
+            match = re.fullmatch(r"vanilla(?:_(\d+(?:\.\d+)*))?", name)
+            if match and os.path.isdir(os.path.join(packs_dir, name)):
+                version = tuple(int(part) for part in (match.group(1) or "").split(".") if part)
+                layers.append((version, os.path.join(packs_dir, name)))
+        return [path for _, path in sorted(layers)]
+
+    def _base_table(self, layers, rel_path):
+        for layer in reversed(layers):
+            path = os.path.join(layer, rel_path)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    @staticmethod
+    def _scale(value, multiplier):
+        if isinstance(value, dict):
+            return {k: DropRatePackBuilder._scale(v, multiplier) for k, v in value.items()}
+        if isinstance(value, (int, float)):
+            return max(1, int(round(value * multiplier)))
+        return value
+
+    @staticmethod
+    def _rule_for(rules, item_name):
+        """按物品名匹配规则，忽略 minecraft:coal:0 这类末尾的数据值"""
+        if item_name in rules:
+            return rules[item_name]
+        base_name, _, data_value = item_name.rpartition(":")
+        if data_value.isdigit() and base_name in rules:
+            return rules[base_name]
+        return rules.get("*")
+
+    @staticmethod
+    def _set_count(value, count):
+        """count 为 "max" 时取原范围的上限，否则直接替换"""
+        if count == "max":
+            return value.get("max", value.get("min", 1)) if isinstance(value, dict) else value
+        return count
+
+    def _apply_table_rule(self, data, table_rule):
+        """keep: 只保留列出的物品，删掉其余条目和因此变空的池; rolls: "max" 取上限或固定次数"""
+        keep = table_rule.get("keep")
+        rolls = table_rule.get("rolls")
+        pools = data.get("pools") if isinstance(data, dict) else None
+        if not isinstance(pools, list):
+            return
+
+        kept_pools = []
+        for pool in pools:
+            if keep is not None and isinstance(pool.get("entries"), list):
+                keep_rules = {name: True for name in keep}
+                pool["entries"] = [entry for entry in pool["entries"]
+                                   if entry.get("type") == "item" and isinstance(entry.get("name"), str)
+                                   and self._rule_for(keep_rules, entry["name"])]
+                if not pool["entries"]:
+                    continue
+            if rolls is not None and "rolls" in pool:
+                pool["rolls"] = self._set_count(pool["rolls"], rolls)
+            kept_pools.append(pool)
+        data["pools"] = kept_pools
+
+    def _apply_rules(self, node, rules):
+        """递归修改战利品表条目的权重/数量和交易表的数量"""
+        if isinstance(node, list):
+            for child in node:
+                self._apply_rules(child, rules)
+            return
+
+        if not isinstance(node, dict):
+            return
+
+        # 战利品表条目
+        if node.get("type") == "item" and isinstance(node.get("name"), str):
+            rule = self._rule_for(rules, node["name"])
+            if rule:
+                if "weight" in rule:
+                    node["weight"] = rule["weight"]
+                if "weight_multiplier" in rule:
+                    node["weight"] = self._scale(node.get("weight", 1), rule["weight_multiplier"])
+                count_functions = [function for function in node.get("functions", [])
+                                   if isinstance(function, dict) and function.get("function") == "set_count"]
+                if "count" in rule and rule["count"] != "max" and not count_functions:
+                    count_functions = [{"function": "set_count", "count": 1}]
+                    node["functions"] = count_functions + node.get("functions", [])
+                for function in count_functions:
+                    if "count" in rule:
+                        function["count"] = self._set_count(function.get("count", 1), rule["count"])
+                    if "count_multiplier" in rule:
+                        function["count"] = self._scale(function.get("count", 1), rule["count_multiplier"])
+
+        # 交易表: gives 按 count_multiplier，wants 按 cost_multiplier
+        for list_key, rule_key in (("gives", "count_multiplier"), ("wants", "cost_multiplier")):
+            for trade_item in node.get(list_key, []) if isinstance(node.get(list_key), list) else []:
+                if isinstance(trade_item, dict) and isinstance(trade_item.get("item"), str):
+                    rule = self._rule_for(rules, trade_item["item"])
+                    if rule and rule_key in rule:
+                        trade_item["quantity"] = self._scale(trade_item.get("quantity", 1), rule[rule_key])
+
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                self._apply_rules(value, rules)
+
+    def _plan(self, tier):
+        """列出输出文件及各自的输入键: 相对路径 -> (生成方式, 源文件, 键, 表规则)
+
+        掉率行为包里的清单、图标和方块定义原样复制；战利品表和交易表只输出档位规则里列出的，
+        取原版表（没有原版表时用规则里的 base）按规则改写。
+        """
+        config = self.load_tiers()
+        rules = self.tier_rules(tier)
+        pack_dir = config["pack_dir"]
+        pack_prefix = os.path.join("behavior_packs", os.path.basename(os.path.normpath(pack_dir)))
+        items_hash = hashlib.sha1(json.dumps(rules["items"], sort_keys=True).encode("utf-8")).hexdigest()
+
+        plan = {}
+        for rel_path, entry in self.deployer.manifest(self.base_dir).items():
+            plan[rel_path] = ("copy", os.path.join(self.base_dir, rel_path), entry["sha1"], None)
+
+        pack_manifest = self.deployer.manifest(pack_dir)
+        for rel_path, entry in pack_manifest.items():
+            if rel_path.split(os.sep, 1)[0] not in self.TRANSFORM_DIRS:
+                plan[os.path.join(pack_prefix, rel_path)] = ("copy", os.path.join(pack_dir, rel_path),
+                                                             entry["sha1"], None)
+
+        layers = self.base_layers()
+        for table_path, table_rule in rules["tables"].items():
+            rel_path = os.path.normpath(table_path)
+            rule_hash = hashlib.sha1(json.dumps(table_rule, sort_keys=True).encode("utf-8")).hexdigest()
+            src = self._base_table(layers, rel_path)
+            if src is not None:
+                src_hash = self.deployer._hash_file(src)
+            elif "base" in table_rule:
+                src_hash = "inline"
+            else:
+                raise FileNotFoundError(f"找不到原版表 {table_path}，服务器目录下需要有 vanilla 行为包"
+                                        f"（{os.path.join(self.server_dir, config.get('base_packs', 'behavior_packs'))}）")
+            plan[os.path.join(pack_prefix, rel_path)] = ("transform", src, f"{src_hash}:{rule_hash}:{items_hash}",
+                                                         table_rule)
+
+        # 世界行为包列表要追加掉率行为包
+        world_packs = "world_behavior_packs.json"
+        base_entry = plan.get(world_packs, ("copy", None, "", None))
+        plan[world_packs] = ("world_packs", os.path.join(pack_dir, "manifest.json"),
+                             f"{base_entry[2]}:{pack_manifest.get('manifest.json', {}).get('sha1')}", None)
+        return plan, rules
+
+    def _write_world_packs(self, template_manifest_path, dst):
+        with open(os.path.join(self.base_dir, "world_behavior_packs.json"), "r", encoding="utf-8-sig") as f:
+            packs = json.load(f)
+        with open(template_manifest_path, "r", encoding="utf-8-sig") as f:
+            header = json.load(f)["header"]
+
+        if not any(p.get("pack_id") == header["uuid"] for p in packs):
+            packs.append({"pack_id": header["uuid"], "version": header["version"]})
+        with open(dst, "w", encoding="utf-8") as f:
+            json.dump(packs, f, ensure_ascii=False, indent=4)
+
+    def _generate(self, kind, src, dst, rules, table_rule):
+        if kind == "copy":
+            shutil.copy2(src, dst)
+        elif kind == "world_packs":
+            self._write_world_packs(src, dst)
+        else:
+            if src is None:
+                data = copy.deepcopy(table_rule["base"])
+            else:
+                try:
+                    with open(src, "r", encoding="utf-8-sig") as f:
+                        data = json.load(f)
+                except ValueError as e:
+                    logger.warning(f"{src} 不是合法JSON，按原样复制: {e}")
+                    shutil.copy2(src, dst)
+                    return
+            self._apply_table_rule(data, table_rule)
+            # 表规则里的 items 只对这张表生效，覆盖档位的同名物品规则
+            item_rules = dict(rules["items"])
+            for name, item_rule in table_rule.get("items", {}).items():
+                item_rules[name] = dict(item_rules.get(name, {}), **item_rule)
+            self._apply_rules(data, item_rules)
+            with open(dst, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+
+    def build(self, tier):
+        """返回该档位资源包的目录；输入没变时直接复用缓存，否则只重新生成变化的文件"""
+        with self.lock:
+            plan, rules = self._plan(tier)
+            input_hash = hashlib.sha1(json.dumps(
+                sorted((path, key) for path, (_, _, key, _) in plan.items())).encode("utf-8")).hexdigest()[:16]
+
+            output_dir = os.path.join(self.cache_dir, f"{tier}-{input_hash}")
+            build_manifest = "build_manifest.json"
+            if os.path.exists(os.path.join(output_dir, build_manifest)):
+                return output_dir
+
+            # 找同一档位的上一次构建，未变化的文件直接复用
+            previous_dir, previous_keys = None, {}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                candidate = os.path.join(self.cache_dir, name)
+                if name.startswith(f"{tier}-") and os.path.exists(os.path.join(candidate, build_manifest)):
+                    try:
+                        with open(os.path.join(candidate, build_manifest), "r", encoding="utf-8") as f:
+                            previous_dir, previous_keys = candidate, json.load(f)
+                        break
+                    except (OSError, ValueError):
+                        continue
+
+            tmp_dir = output_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            rebuilt = 0
+            for rel_path, (kind, src, key, table_rule) in plan.items():
+                dst = os.path.join(tmp_dir, rel_path)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if previous_keys.get(rel_path) == key:
+                    shutil.copy2(os.path.join(previous_dir, rel_path), dst)
+                else:
+                    self._generate(kind, src, dst, rules, table_rule)
+                    rebuilt += 1
+
+            with open(os.path.join(tmp_dir, build_manifest), "w", encoding="utf-8") as f:
+                json.dump({path: key for path, (_, _, key, _) in plan.items()}, f, ensure_ascii=False, indent=2)
+            os.rename(tmp_dir, output_dir)
+            logger.info(f"掉率资源包 {tier} 已构建，重新生成 {rebuilt}/{len(plan)} 个文件")
+
+            # 删除同一档位的旧构建
+            for name in os.listdir(self.cache_dir):
+                candidate = os.path.join(self.cache_dir, name)
+                if name.startswith(f"{tier}-") and candidate != output_dir:
+                    shutil.rmtree(candidate, ignore_errors=True)
+
+            return output_dir
+
+
+class SeedIndex:
+    """种子索引: 每种村庄类型一个有符号32位整数数组，只在文件变化时重新读取"""
+
+    def __init__(self, seed_files, weighting="file", report=None):
+        # seed_files: 文件名 -> 村庄类型
+        self.seed_files = seed_files
+        # "file": 每个文件等概率; "seed": 每个种子等概率; dict: 文件名 -> 权重
+        self.weighting = weighting
+        # report(消息): 报告跳过的无效种子
+        self.report = report
+        self.seeds = {}
+        self.stamps = {}
+        self.cumulative = []
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """检查种子文件的修改时间，变化过的文件重新载入"""
+        changed = False
+        for filename in self.seed_files:
+            try:
+                st = os.stat(filename)
+                stamp = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+
+            if stamp == self.stamps.get(filename, False):
+                continue
+
+            seeds = array("i")
+            if stamp is not None:
+                with open(filename, "rb") as f:
+                    invalid = self._parse(f.read(), seeds)
+                if invalid and self.report:
+                    examples = ", ".join(token.decode("utf-8", "replace") for token in invalid[:3])
+                    self.report(f"种子文件 {filename} 中有 {len(invalid)} 个无效种子已跳过（非整数或超出32位范围）: {examples}")
+            self.seeds[filename] = seeds
+            self.stamps[filename] = stamp
+            changed = True
+
+        if changed:
+            self._rebuild_weights()
+        return changed
+
+    @staticmethod
+    def _parse(data, seeds):
+        """把空白分隔的种子追加到数组，返回无法解析的记号"""
+        invalid = []
+        for token in data.split():
+            try:
+                seeds.append(int(token))
+            except (ValueError, OverflowError):
+                invalid.append(token)
+        return invalid
+
+    def _rebuild_weights(self):
+        """按选择方式计算各文件的累计权重，供二分查找"""
+        total = 0
+        self.cumulative = []
+        for filename in self.seed_files:
+            count = len(self.seeds.get(filename, ()))
+            if count == 0:
+                weight = 0
+            elif self.weighting == "seed":
+                weight = count
+            elif isinstance(self.weighting, dict):
+                weight = self.weighting.get(filename, 0)
+            else:
+                weight = 1
+            total += weight
+            self.cumulative.append(total)
+
+    def count(self, filename=None):
+        if filename is not None:
+            return len(self.seeds.get(filename, ()))
+        return sum(len(seeds) for seeds in self.seeds.values())
+
+    def pick_file(self, rng=random):
+        """按权重选择一个种子文件"""
+        with self.lock:
+            self.refresh()
+            if not self.cumulative or self.cumulative[-1] <= 0:
+                raise ValueError("所有种子文件都为空")
+            position = rng.random() * self.cumulative[-1]
+            return list(self.seed_files)[bisect.bisect_right(self.cumulative, position)]
+
+    def pick(self, rng=random):
+        """返回 (文件名, 村庄类型, 种子)"""
+        filename = self.pick_file(rng)
+        seeds = self.seeds[filename]
+        return filename, self.seed_files[filename], seeds[rng.randrange(len(seeds))]
+
+
+class SeedScheduler:
+    """不重复的种子发牌器: 每种村庄类型一副洗好的牌，整副发完之前同一种子不会重复出现
+
+    洗牌顺序由 (洗牌密钥, 种子) 的哈希决定，与种子在文件中的位置无关，
+    所以每副牌只需持久化 密钥 和 上一张牌的哈希 两个数。文件中新增的种子
+    若哈希排在当前位置之后会在本轮发出，否则留到下一轮；删除的种子直接消失。
+
+    预备世界和预热服务器只"预留"种子: 发牌位置只记在内存里，真正开局时
+    commit 才写入进度，程序重启后没玩过的预留种子会重新发出。
+    """
+
+    MASK64 = (1 << 64) - 1
+
+    def __init__(self, index, state_file):
+        self.index = index
+        self.state_file = state_file
+        self.state = {}
+        # 文件名 -> (文件时间戳, 密钥, 排好序的哈希数组, 对应的种子数组)
+        self.decks = {}
+        # 文件名 -> (密钥, 最后一张预留牌的哈希)；种子 -> (文件名, 密钥, 哈希)
+        self.reserved = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self._load_state()
+
+    @classmethod
+    def _mix(cls, key, seed):
+        """splitmix64 混合函数"""
+        z = (key + (seed & 0xFFFFFFFF) * 0x9E3779B97F4A7C15) & cls.MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & cls.MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & cls.MASK64
+        return z ^ (z >> 31)
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.state = data
+        except (OSError, ValueError):
+            self.state = {}
+
+    def _save_state(self):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def _new_epoch(self, filename):
+        previous = self.state.get(filename, {})
+        self.state[filename] = {
+            "key": random.getrandbits(64),
+            "cursor": -1,
+            "epoch": previous.get("epoch", 0) + 1
+        }
+        return self.state[filename]
+
+    def _deck(self, filename, deck_state):
+        """按当前密钥给该文件的种子排序，种子文件或密钥变化时重建"""
+        stamp = self.index.stamps.get(filename)
+        cached = self.decks.get(filename)
+        if cached and cached[0] == stamp and cached[1] == deck_state["key"]:
+            return cached[2], cached[3]
+
+        key = deck_state["key"]
+        order = sorted((self._mix(key, seed), seed) for seed in self.index.seeds.get(filename, ()))
+        hashes = array("Q", (h for h, _ in order))
+        seeds = array("i", (seed for _, seed in order))
+        self.decks[filename] = (stamp, key, hashes, seeds)
+        return hashes, seeds
+
+    def draw(self, filename, reserve=False):
+        """发出该文件牌堆中的下一个种子；reserve=True 时只预留，不写入进度"""
+        with self.lock:
+            deck_state = self.state.get(filename) or self._new_epoch(filename)
+            hashes, seeds = self._deck(filename, deck_state)
+            if not seeds:
+                raise ValueError(f"种子文件 {filename} 为空")
+
+            cursor = deck_state["cursor"]
+            reserved = self.reserved.get(filename)
+            if reserved and reserved[0] == deck_state["key"]:
+                cursor = max(cursor, reserved[1])
+
+            position = bisect.bisect_right(hashes, cursor)
+            if position >= len(seeds):
+                # 整副牌已发完，换一个密钥重新洗牌
+                deck_state = self._new_epoch(filename)
+                hashes, seeds = self._deck(filename, deck_state)
+                position = 0
+
+            seed = seeds[position]
+            if reserve:
+                self.reserved[filename] = (deck_state["key"], hashes[position])
+                self.pending[seed] = (filename, deck_state["key"], hashes[position])
+                return seed
+
+            deck_state["cursor"] = hashes[position]
+            self._save_state_quietly()
+            return seed
+
+    def commit(self, seed):
+        """预留的种子真正开局后写入发牌进度"""
+        with self.lock:
+            entry = self.pending.pop(int(seed), None)
+            if not entry:
+                return
+            filename, key, seed_hash = entry
+            deck_state = self.state.get(filename)
+            if deck_state and deck_state["key"] == key and seed_hash > deck_state["cursor"]:
+                deck_state["cursor"] = seed_hash
+                self._save_state_quietly()
+
+    def _save_state_quietly(self):
+        try:
+            self._save_state()
+        except OSError as e:
+            logger.warning(f"保存种子发牌进度失败: {e}")
+
+    def remaining(self, filename):
+        """本轮还没发出的种子数"""
+        with self.lock:
+            deck_state = self.state.get(filename)
+            if not deck_state:
+                return self.index.count(filename)
+            hashes, _ = self._deck(filename, deck_state)
+            return len(hashes) - bisect.bisect_right(hashes, deck_state["cursor"])
+
+
+class SeedMetrics:
+    """种子性能数据表: 种子 -> 生成耗时、db大小、峰值内存"""
+
+    def __init__(self, metrics_file):
+        self.metrics_file = metrics_file
+        self.metrics = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.metrics_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.metrics = data
+        except (OSError, ValueError):
+            self.metrics = {}
+
+    def get(self, seed):
+        with self.lock:
+            return self.metrics.get(str(seed))
+
+    def record(self, seed, result):
+        with self.lock:
+            self.metrics[str(seed)] = result
+            tmp_file = self.metrics_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.metrics, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.metrics_file)
+
+    def allowed(self, seed, max_ready_seconds=0, max_db_mb=0):
+        """没有测过的种子一律放行；阈值为0表示不限制"""
+        result = self.get(seed)
+        if not result or not result.get("ok"):
+            return True
+        if max_ready_seconds and result.get("ready_seconds", 0) > max_ready_seconds:
+            return False
+        if max_db_mb and result.get("db_bytes", 0) > max_db_mb * 1024 * 1024:
+            return False
+        return True
+
+
+class SeedProfiler:
+    """批量测量种子的生成成本: 每个种子在独立的临时服务器目录中启动一次bedrock_server"""
+
+    def __init__(self, server_dir, exe_name, scratch_dir, ready_text, timeout, jobs=None, base_port=40000):
+        self.server_dir = server_dir
+        self.exe_name = exe_name
+        self.scratch_dir = scratch_dir
+        self.ready_text = ready_text
+        self.timeout = timeout
+        # 每个服务器实例生成世界时基本占满一个核心
+        self.jobs = max(1, min(jobs or os.cpu_count() or 1, os.cpu_count() or 1))
+        self.base_port = base_port
+        self.stop_event = threading.Event()
+
+    def _prepare_slot(self, slot):
+        """为一个实例准备服务器目录副本（不含世界），程序和资源文件用硬链接，配置文件单独复制"""
+        slot_dir = os.path.join(self.scratch_dir, f"slot{slot}")
+        if not os.path.exists(os.path.join(slot_dir, self.exe_name)):
+            shutil.rmtree(slot_dir, ignore_errors=True)
+            shutil.copytree(self.server_dir, slot_dir, copy_function=copy_server_file,
+                            ignore=shutil.ignore_patterns("worlds"))
+        else:
+            # 旧版本创建的副本里配置文件也是硬链接，断开链接以免改写到主服务器的文件
+            for name in os.listdir(slot_dir):
+                path = os.path.join(slot_dir, name)
+                if name.endswith((".properties", ".json", ".txt")) and os.stat(path).st_nlink > 1:
+                    shutil.copy2(path, path + ".tmp")
+                    os.replace(path + ".tmp", path)
+        return slot_dir
+
+    @staticmethod
+    def peak_rss(process):
+        """读取进程的峰值内存（字节），不支持的平台返回None"""
+        try:
+            if sys.platform.startswith("linux"):
+                with open(f"/proc/{process.pid}/status", "r") as f:
+                    for line in f:
+                        if line.startswith("VmHWM:"):
+                            return int(line.split()[1]) * 1024
+            elif os.name == "nt":
+                class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                                ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+                PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+                kernel32 = ctypes.windll.kernel32
+                kernel32.OpenProcess.restype = ctypes.c_void_p
+                handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, process.pid)
+                if not handle:
+                    return None
+                try:
+                    counters = PROCESS_MEMORY_COUNTERS()
+                    counters.cb = ctypes.sizeof(counters)
+                    if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.c_void_p(handle), ctypes.byref(counters),
+                                                                counters.cb):
+                        return counters.PeakWorkingSetSize
+                finally:
+                    kernel32.CloseHandle(ctypes.c_void_p(handle))
+        except (OSError, ValueError, AttributeError):
+            pass
+        return None
+
+    @staticmethod
+    def _db_size(db_dir):
+        total = 0
+        for root, _, files in os.walk(db_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def profile_one(self, slot, seed, prepare_world=None, keep_world=None):
+        """启动一次服务器并测量，返回结果字典
+
+        keep_world(seed, level_dir): 服务器正常就绪并正常退出后调用，此时世界数据库已写完并关闭
+        """
+        slot_dir = self._prepare_slot(slot)
+        world_dir = os.path.join(slot_dir, "worlds")
+        shutil.rmtree(world_dir, ignore_errors=True)
+        level_dir = os.path.join(world_dir, "Bedrock level")
+        os.makedirs(level_dir)
+        if prepare_world:
+            prepare_world(level_dir)
+        port = self.base_port + slot * 2
+        write_server_properties(os.path.join(slot_dir, "server.properties"), {
+            "level-seed": str(seed), "server-port": str(port), "server-portv6": str(port + 1),
+            "level-name": "Bedrock level"
+        })
+
+        ready_event = threading.Event()
+        output = ServerOutputPump(200)
+        output.add_listener(lambda entry: self.ready_text in entry["message"] and ready_event.set())
+
+        result = {"ok": False, "profiled_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        launch_time = time.monotonic()
+        process = subprocess.Popen([os.path.join(slot_dir, self.exe_name)], cwd=slot_dir,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, errors="replace", bufsize=1)
+        output.attach(process)
+        try:
+            deadline = launch_time + self.timeout
+            while time.monotonic() < deadline and not self.stop_event.is_set():
+                if ready_event.wait(0.05):
+                    result["ok"] = True
+                    result["ready_seconds"] = round(time.monotonic() - launch_time, 2)
+                    break
+                if process.poll() is not None:
+                    result["error"] = "服务器进程异常退出"
+                    break
+            else:
+                result["error"] = "已取消" if self.stop_event.is_set() else f"{self.timeout}秒内未就绪"
+
+            result["peak_rss"] = self.peak_rss(process)
+        finally:
+            stopped_cleanly = False
+            try:
+                if process.poll() is None:
+                    process.stdin.write("stop\n")
+                    process.stdin.flush()
+                    process.wait(timeout=30)
+                    stopped_cleanly = True
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                process.kill()
+                process.wait()
+
+        result["db_bytes"] = self._db_size(os.path.join(level_dir, "db"))
+        if keep_world and result["ok"] and stopped_cleanly:
+            keep_world(seed, level_dir)
+        return result
+
+    def run(self, seeds, prepare_world=None, on_result=None, keep_world=None):
+        """用 jobs 个并行实例测量所有种子，seeds 为 (种子文件, 种子) 序列"""
+        work = deque(seeds)
+        work_lock = threading.Lock()
+
+        def worker(slot):
+            while not self.stop_event.is_set():
+                with work_lock:
+                    if not work:
+                        return
+                    seed_file, seed = work.popleft()
+                try:
+                    result = self.profile_one(slot, seed, prepare_world, keep_world)
+                except Exception as e:
+                    result = {"ok": False, "error": str(e)}
+                result["seed_file"] = seed_file
+                if on_result:
+                    on_result(seed, result)
+
+        workers = [threading.Thread(target=worker, args=(slot,), daemon=True) for slot in range(self.jobs)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class DbDirWatcher:
+    """监视世界db目录的写入事件：Linux下使用inotify，其他平台退回定时轮询"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self, path, use_inotify=True):
+        self.path = path
+        self.libc = None
+        self.fd = None
+        self.wd = None
+
+        if use_inotify and platform.system() == "Linux":
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+                if fd >= 0:
+                    self.libc = libc
+                    self.fd = fd
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify不可用，退回轮询: {e}")
+
+    @property
+    def using_inotify(self):
+        return self.fd is not None
+
+    def _ensure_watch(self):
+        """db目录在服务器生成世界之后才出现，需要时再添加监视"""
+        if self.wd is not None:
+            return True
+        if not os.path.isdir(self.path):
+            return False
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.path), self.WATCH_MASK)
+        if wd < 0:
+            return False
+
+        self.wd = wd
+        return True
+
+    def _drain(self):
+        """读空事件队列，一批事件只触发一次扫描"""
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, _cookie, length = struct.unpack_from("iIII", data, offset)
+                offset += 16 + length
+
+                if wd != self.wd:
+                    continue
+                if mask & self.IN_MOVE_SELF:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    self.wd = None
+                elif mask & (self.IN_DELETE_SELF | self.IN_IGNORED):
+                    self.wd = None
+
+    def wait(self, timeout):
+        """等待目录变化，返回True表示有事件，False表示超时"""
+        if self.fd is None or not self._ensure_watch():
+            time.sleep(timeout)
+            return False
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+
+        self._drain()
+        return True
+
+    def close(self):
+        """关闭inotify句柄"""
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+            self.wd = None
+
+
+class ScoreStore:
+    """成绩存储: SQLite的WAL模式，每次挑战一行attempts记录，汇总字段存在aggregates表"""
+
+    # 汇总字段，值以JSON保存
+    AGGREGATE_KEYS = ("total_score", "current_rank", "rank_progress", "rank_stars", "best_time", "best_seed",
+                      "best_village_type", "total_attempts", "successful_attempts", "top_scores", "last_modified")
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS attempts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                success INTEGER,
+                seed TEXT,
+                total_score REAL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_attempts_timestamp ON attempts(timestamp);
+            CREATE INDEX IF NOT EXISTS idx_attempts_success ON attempts(success, total_score);
+            CREATE TABLE IF NOT EXISTS aggregates (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS migrations (
+                source TEXT PRIMARY KEY,
+                migrated_at TEXT NOT NULL
+            );
+        """)
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM aggregates").fetchone()[0] == 0
+
+    def data_version(self, blocking=True):
+        """其他连接（外部程序）提交修改后这个值会变化；不阻塞时拿不到锁返回None"""
+        if not self.lock.acquire(blocking):
+            return None
+        try:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            self.lock.release()
+
+    def load(self, recent=20):
+        """读取汇总字段和最近 recent 条记录（按时间顺序）"""
+        with self.lock:
+            data = {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM aggregates")}
+            rows = self.conn.execute("SELECT record FROM attempts ORDER BY id DESC LIMIT ?", (recent,)).fetchall()
+        data["scores"] = [json.loads(row[0]) for row in reversed(rows)]
+        return data
+
+    def attempts(self, after=0, limit=500):
+        """按id增量读取原始记录，返回 (记录列表, 最后一条的id)"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, record FROM attempts WHERE id > ? ORDER BY id LIMIT ?",
+                                     (after, limit)).fetchall()
+            last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM attempts").fetchone()[0]
+        return [json.loads(record) for _, record in rows], (rows[-1][0] if rows else max(after, 0)), last_id
+
+    def save(self, data, new_records, migrated_from=None):
+        """在一个事务里写入新记录和汇总字段（导入旧文件时同时记下来源）"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if migrated_from:
+                    self.conn.execute("INSERT OR REPLACE INTO migrations (source, migrated_at) VALUES (?, ?)",
+                                      (migrated_from, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                self.conn.executemany(
+                    "INSERT INTO attempts (timestamp, success, seed, total_score, record) VALUES (?, ?, ?, ?, ?)",
+                    [(r.get("timestamp"), int(bool(r.get("success"))), str(r.get("seed")), r.get("total_score"),
+                      json.dumps(r, ensure_ascii=False)) for r in new_records])
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO aggregates (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(data.get(key), ensure_ascii=False)) for key in self.AGGREGATE_KEYS])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def is_migrated(self, source):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM migrations WHERE source = ?", (source,)).fetchone() is not None
+
+    def migrate_from_json(self, json_path):
+        """一次性导入旧的JSON成绩文件；文件保持原样，导入记录写在数据库里"""
+        source = os.path.basename(json_path)
+        if not os.path.exists(json_path) or self.is_migrated(source) or not self.is_empty():
+            return False
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return False
+
+        records = [r for r in data.get("scores", []) if isinstance(r, dict)]
+        self.save(data, records, migrated_from=source)
+        return True
+
+
+def available_memory_bytes():
+    """返回主机可用内存（字节），无法获取时返回None"""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/meminfo", "r") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        elif os.name == "nt":
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(status)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
 class FSGSystem:
-    def __init__(self):
+    @property
+    def current_session(self):
+        return self._current_session
+
+    @current_session.setter
+    def current_session(self, session):
+        """替换会话时同时发布只读快照，get_status 读取快照不需要加锁"""
+        with self.session_lock:
+            self._current_session = session
+            self.session_snapshot = MappingProxyType(dict(session)) if session else None
+        self.bump_state_version()
+
+    def update_session(self, **changes):
+        """在 session_lock 内对当前会话做读-改-写，会话已结束时返回False"""
+        with self.session_lock:
+            session = self._current_session
+            if not session:
+                return False
+            session = dict(session, **changes)
+            self._current_session = session
+            self.session_snapshot = MappingProxyType(dict(session))
+        self.bump_state_version()
+        return True
+
+    @property
+    def is_monitoring(self):
+        return self._is_monitoring
+
+    @is_monitoring.setter
+    def is_monitoring(self, value):
+        self._is_monitoring = value
+        self.bump_state_version()
+
+    @property
+    def is_shutting_down(self):
+        return self._is_shutting_down
+
+    @is_shutting_down.setter
+    def is_shutting_down(self, value):
+        self._is_shutting_down = value
+        self.bump_state_version()
+
+    def __init__(self, instance_id=None, server_dir=None, scores_file=None, shared=None, state_dir=None):
+        # 多实例模式下每个实例有自己的服务器目录和成绩文件，种子索引等只读资源与 shared 共用
+        self.instance_id = instance_id
+        # 成绩、发牌进度、缓存等运行状态的存放目录；同一主机运行多个代理时各用各的，默认为当前目录
+        self.state_dir = state_dir or ""
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+        self.is_closed = False
+        self.session_lock = threading.Lock()
+        # 推送给 /api/events 的事件
+        self.events = EventBroadcaster()
+        # 状态版本号: 会话、成绩、监控和关闭状态每次变化都加一，/api/status 等据此生成ETag
+        self.state_version = 0
+        self.state_version_lock = threading.Lock()
+        # (状态版本, 状态)，同一版本的状态只生成一次，多个SSE连接共用
+        self.status_payload_cache = None
+        self.status_payload_lock = threading.Lock()
+        # ETag 前缀，避免重启后版本号从头开始与旧的ETag撞上
+        self.etag_prefix = uuid.uuid4().hex[:8]
+        # 接口名 -> (ETag, 序列化后的响应体)
+        self.response_cache = {}
+        # Windows下按进程名结束残留服务器；同机有其他实例时必须关闭
+        self.kill_stray_servers = instance_id is None
+        self.session_slot = None
+        self.player = None
         self.current_session = None
         self.server_process = None
         self.log_monitor = None
@@ -27,48 +2055,157 @@ class FSGSystem:
         self.is_monitoring = False
         self.last_log_file = None
         self.increased_drop_rate = False
+        # 掉率档位: "normal" 为正常掉率，其余档位定义在 drop_rate_tiers.json
+        self.drop_rate_tier = "normal"
         self.pure_trial_bonus = 0
 
-        # 消息队列
-        self.message_queue = []
+        # 检测方式: "file" 扫描世界数据库, "console" 通过服务器控制台查询
+        self.detection_mode = "file"
+        self.console_query_interval = 2
+        self.console_detector = None
+
+        # 服务器控制台输出缓冲区
+        self.server_output = ServerOutputPump(2000)
+
+        # 服务器启动就绪判断
+        self.server_ready_text = "Server started."
+        self.server_start_timeout = 60
+        self.startup_timings = MappingProxyType({})
+
+        # 预备世界池: 掉率档位 -> [{"path", "seed", "village_type"}]
+        self.world_pool_size = 1
+        self.world_pool = {}
+        self.world_pool_lock = threading.Lock()
+        self.world_pool_refill = threading.Event()
+
+        # 回收区: 限速删除旧世界，超过磁盘预算时全速删除
+        self.trash_reap_rate_mb = 20
+        self.trash_max_mb = 2048
+        self.trash_bytes = 0
+        self.trash_lock = threading.Lock()
+        self.trash_pending = threading.Event()
+
+        # 资源包增量部署
+        self.resource_link_mode = "auto"
+        self.resource_deployer = None
+
+        # 预热下一局的服务器，prewarm_port_offset 为备用目录相对主端口的偏移
+        self.prewarm_next_server = False
+        self.prewarm_port_offset = 2
+        self.warm_server = None
+        self.warm_thread = None
+        self.warm_lock = threading.Lock()
+
+        # 多实例: max_sessions 为0时只按CPU核心数和内存限制
+        self.max_sessions = 0
+        self.session_cores = 1
+        self.session_memory_mb = 1024
+        # 实例服务器端口的起点，0表示取主服务器的端口；同一主机上的多个代理必须各不相同
+        self.session_base_port = 0
+
+        # 世界快照缓存，world_cache_mb 为0时关闭
+        self.world_cache_mb = 512
+        self.world_cache = None
+
+        # 种子索引，seed_weighting 见 SeedIndex
+        self.seed_files = {
+            "seed0.txt": "平原村",
+            "seed1.txt": "沙漠村",
+            "seed2.txt": "雪原村",
+            "seed3.txt": "云杉村",
+            "seed4.txt": "金合欢村"
+        }
+        self.seed_weighting = "file"
+        self.seed_index = None
+        # 不重复发种子，发牌进度保存在 seed_deck.json
+        self.seed_no_repeat = True
+        self.seed_deck_file = os.path.join(self.state_dir, "seed_deck.json")
+        self.seed_scheduler = None
+        # 种子性能数据，超过阈值的种子在选种时跳过（0为不限制）
+        self.seed_metrics = SeedMetrics(os.path.join(self.state_dir, "seed_metrics.json"))
+        self.seed_max_ready_seconds = 0
+        self.seed_max_db_mb = 0
+        self.seed_profile_jobs = 0
+        self.seed_profiler = None
+        self.seed_profile_progress = None
+        # 种子文件读取失败或所有种子都被过滤时使用的备用种子
+        self.backup_seed = 564030617
+
+        # 消息队列: 固定容量的环形缓冲区，每条消息带递增id
         self.max_messages = 100
+        self.message_queue = deque(maxlen=self.max_messages)
+        self.message_next_id = 1
 
         # 60秒关闭计时器
         self.shutdown_timer = None
         self.is_shutting_down = False
 
-        # 线程锁
-        self.lock = threading.Lock()
+        # 线程锁: 会话、成绩、消息各自独立，互不等待（session_lock 在最前面创建）
+        # 结算时持锁修改成绩后还要调用 save_scores，需要可重入
+        self.scores_lock = threading.RLock()
+        # message_lock 只在追加一条消息或切出新消息时短暂持有
+        self.message_lock = threading.Lock()
+        # 供只读接口使用的不可变快照，每次修改后整体替换
+        self.scores_snapshot = None
 
         # 目标物品
         self.target_item = "minecraft:dragon_egg"
 
+        # 数据库文件增量读取器
+        self.target_item_bytes = self.target_item.encode('utf-8')
+        self.log_reader = LevelDBLogReader()
+        self.table_reader = SSTableReader()
+
         # 关键：根据实际文件结构调整服务器路径
         # 获取当前脚本所在目录
         script_dir = os.path.dirname(os.path.abspath(__file__))
         # 脚本在 main 目录中，服务器在上一级的 bedrock-server-1.16.10.02 目录
-        self.server_dir = os.path.join(os.path.dirname(script_dir), "bedrock-server-1.16.10.02")
+        self.server_dir = server_dir or os.path.join(os.path.dirname(script_dir), "bedrock-server-1.16.10.02")
 
         # 服务器相关文件路径
-        self.server_properties = os.path.join(self.server_dir, "server.properties")
-        self.bedrock_server_exe = os.path.join(self.server_dir, "bedrock_server.exe")
-        self.world_dir = os.path.join(self.server_dir, "worlds")
-        self.server_log_file = os.path.join(self.server_dir, "logs", "latest.log")
+        self.set_server_dir(self.server_dir)
+        # 双缓冲: 预热服务器使用备用目录，接管后两个目录互换角色
+        self.server_dirs = [self.server_dir, self.server_dir + "_b"]
 
-        # 世界数据库路径
-        self.world_db_path = os.path.join(self.world_dir, "Bedrock level", "db")
+        # 预备世界存放目录，与worlds在同一文件系统上才能原子重命名
+        self.world_staging_dir = os.path.join(self.world_dir, ".fsg_staging")
+        # 旧世界回收区，同样需要和worlds在同一文件系统上
+        self.world_trash_dir = os.path.join(self.world_dir, ".fsg_trash")
 
         # FSG资源路径 - 这些在 main 目录中
-        self.mclog_dir = "mclog"  # 当前目录下的 mclog
+        self.mclog_dir = os.path.join(self.state_dir, "mclog")  # 当前目录（或状态目录）下的 mclog
+        if instance_id:
+            self.mclog_dir = os.path.join(self.mclog_dir, instance_id)
+        self.world_cache_dir = os.path.join(self.state_dir, "world_cache")  # 世界快照缓存
         self.fsg_resource_dir = "FSG_resource"  # 当前目录下的 FSG_resource
         self.fsg_resource_packed_dir = "FSG_resource_packed"  # 当前目录下的 FSG_resource_packed
+        self.drop_rate_tiers_file = "drop_rate_tiers.json"  # 掉率档位定义
+        self.pack_cache_dir = os.path.join(self.state_dir, "pack_cache")  # 生成的掉率资源包缓存
 
         # 确保目录存在
         os.makedirs(self.mclog_dir, exist_ok=True)
 
+        # 服务器版本取自目录名，用作世界快照缓存键的一部分
+        version_match = re.search(r"(\d+(?:\.\d+)+)", os.path.basename(self.server_dirs[0]))
+        self.server_version = version_match.group(1) if version_match else "unknown"
+
         # 配置文件 - 在当前目录下
         self.config_file = "fsg_config.json"
-        self.scores_file = "fsg_scores.json"
+        self.scores_file = scores_file or os.path.join(self.state_dir, "fsg_scores.json")
+        # 成绩数据库，旧的JSON成绩文件首次启动时导入
+        self.scores_db = os.path.splitext(self.scores_file)[0] + ".db"
+        self.score_store = None
+        # scores_data["scores"] 只保留最近的记录，其中前 scores_saved_count 条已写入数据库
+        self.scores_saved_count = 0
+        # 已写入数据库的记录在内存中最多保留的条数
+        self.scores_keep_recent = 20
+        # 内存中的成绩是唯一权威数据，由后台线程合并写入；只有数据库被外部修改时才重新读取
+        self.scores_loaded = False
+        self.scores_dirty = False
+        self.scores_data_version = None
+        self.scores_flush_delay = 0.2
+        self.scores_flush_event = threading.Event()
+        self.scores_flush_lock = threading.Lock()
 
         # ========== 段位系统定义保持不变 ==========
         self.ranks = [
@@ -135,7 +2272,18 @@ class FSGSystem:
 
         # 加载配置和成绩
         self.load_config()
+        self.score_store = ScoreStore(self.scores_db)
+        try:
+            if self.score_store.migrate_from_json(self.scores_file):
+                self.add_message(f"已将 {self.scores_file} 导入成绩数据库 {self.scores_db}")
+        except Exception as e:
+            self.add_message(f"导入旧成绩文件失败: {e}", "error")
         self.load_scores()
+        self.start_score_writer()
+        atexit.register(self.flush_scores)
+        if instance_id:
+            # 预热服务器只在单实例模式下使用
+            self.prewarm_next_server = False
 
         # 添加调试信息，确认路径正确
         self.add_message(f"脚本目录: {script_dir}")
@@ -145,28 +2293,118 @@ class FSGSystem:
         self.add_message(f"服务器目录是否存在: {os.path.exists(self.server_dir)}")
         self.add_message(f"server.properties是否存在: {os.path.exists(self.server_properties)}")
 
+        if shared:
+            self.resource_deployer = shared.resource_deployer
+            self.pack_builder = shared.pack_builder
+            self.seed_index = shared.seed_index
+            self.seed_scheduler = shared.seed_scheduler
+            self.seed_metrics = shared.seed_metrics
+            self.world_cache = shared.world_cache
+        else:
+            self._init_shared_resources()
+
+        self.start_world_stager()
+        if os.path.isdir(self.server_dir):
+            self.start_trash_reaper()
+
+    def _init_shared_resources(self):
+        """创建可在多个实例间共用的资源: 资源包、种子索引、世界快照缓存"""
+        # 启动时先计算好两种资源包的哈希清单
+        self.resource_deployer = ResourceDeployer(self.resource_link_mode)
+        for source_dir in (self.fsg_resource_dir, self.fsg_resource_packed_dir):
+            if os.path.isdir(source_dir):
+                self.resource_deployer.manifest(source_dir)
+        self.pack_builder = DropRatePackBuilder(self.resource_deployer, self.fsg_resource_dir,
+                                                self.drop_rate_tiers_file, self.pack_cache_dir, self.server_dir)
+
+        self.seed_index = SeedIndex(self.seed_files, self.seed_weighting,
+                                    lambda message: self.add_message(message, "warning"))
+        try:
+            self.seed_index.refresh()
+            self.add_message(f"种子索引已载入: {self.seed_index.count()} 个种子")
+            if self.seed_no_repeat:
+                self.seed_scheduler = SeedScheduler(self.seed_index, self.seed_deck_file)
+        except Exception as e:
+            self.add_message(f"载入种子索引失败: {e}", "error")
+
+        if self.world_cache_mb > 0:
+            self.world_cache = WorldSnapshotCache(self.world_cache_dir, self.world_cache_mb * 1024 * 1024)
+
+    def close(self):
+        """关闭实例: 停止服务器和后台线程"""
+        self.is_closed = True
+        self.flush_scores()
+        self.scores_flush_event.set()
+        self.is_monitoring = False
+        self.cancel_shutdown_timer()
+        self.discard_warm_server()
+        self.stop_server()
+        self.current_session = None
+        self.world_pool_refill.set()
+        self.trash_pending.set()
+
     def add_message(self, message, msg_type="info"):
         """添加消息到队列，替代原来的gui_callback"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         formatted_msg = f"[{timestamp}] {message}"
+        if self.instance_id:
+            formatted_msg = f"[{self.instance_id}] {formatted_msg}"
 
-        with self.lock:
-            self.message_queue.append({
+        with self.message_lock:
+            # 环形缓冲区满时自动丢弃最旧的消息
+            entry = {
+                "id": self.message_next_id,
                 "time": timestamp,
                 "message": message,
                 "type": msg_type
-            })
+            }
+            self.message_queue.append(entry)
+            self.message_next_id += 1
 
-            # 保持队列长度
-            if len(self.message_queue) > self.max_messages:
-                self.message_queue = self.message_queue[-self.max_messages:]
+        self.events.publish("message", entry, entry["id"])
 
         logger.info(formatted_msg)
 
+    def bump_state_version(self):
+        """状态发生变化: 版本号加一并推送新状态"""
+        with self.state_version_lock:
+            self.state_version += 1
+        self.publish_status()
+
+    def status_cache_key(self):
+        """/api/status 的缓存键，只取状态版本；用时由页面按 started_at 自己走表，
+        响应里的 elapsed_* 是生成时的值，状态没变化时可能已经过期"""
+        return (self.state_version,)
+
+    def publish_status(self):
+        """通知SSE连接状态已变化；调用方往往持有会话或成绩锁，状态由连接线程取走通知时再生成，
+        连续多次变化只生成一次"""
+        self.events.notify("status")
+
+    def shared_status_payload(self):
+        """当前状态版本的状态，同一版本只生成一次"""
+        version = self.state_version
+        with self.status_payload_lock:
+            if self.status_payload_cache is None or self.status_payload_cache[0] != version:
+                self.status_payload_cache = (version, self.status_payload())
+            return self.status_payload_cache[1]
+
     def get_messages(self, last_n=20):
         """获取最近的消息"""
-        with self.lock:
-            return self.message_queue[-last_n:] if self.message_queue else []
+        with self.message_lock:
+            start = max(0, len(self.message_queue) - last_n)
+            return list(itertools.islice(self.message_queue, start, None))
+
+    def get_messages_after(self, after):
+        """返回id大于after的消息，只遍历新增部分；after比最新id还大时（服务重启过）返回全部"""
+        with self.message_lock:
+            if not self.message_queue:
+                return []
+            first_id = self.message_queue[0]["id"]
+            if after >= self.message_next_id:
+                after = 0
+            start = max(0, after - first_id + 1)
+            return list(itertools.islice(self.message_queue, start, None))
 
     def load_config(self):
         """加载配置"""
@@ -174,6 +2412,28 @@ class FSGSystem:
             "minecraft_path": "",
             "monitor_interval": 5,
             "penalty_seconds": 30,
+            "use_inotify": True,
+            "detection_mode": "file",
+            "console_query_interval": 2,
+            "server_start_timeout": 60,
+            "world_pool_size": 1,
+            "trash_reap_rate_mb": 20,
+            "trash_max_mb": 2048,
+            "world_cache_mb": 512,
+            "resource_link_mode": "auto",
+            "seed_weighting": "file",
+            "seed_no_repeat": True,
+            "seed_max_ready_seconds": 0,
+            "seed_max_db_mb": 0,
+            "seed_profile_jobs": 0,
+            "prewarm_next_server": False,
+            "prewarm_port_offset": 2,
+            "max_sessions": 0,
+            "session_cores": 1,
+            "session_memory_mb": 1024,
+            "session_base_port": 0,
+            "cluster_agents": [],
+            "cluster_poll_interval": 5,
             "program_version": "1.0.0"
         }
 
@@ -185,6 +2445,27 @@ class FSGSystem:
                         self.config = config
                         self.monitor_interval = config.get("monitor_interval", self.monitor_interval)
                         self.penalty_seconds = config.get("penalty_seconds", self.penalty_seconds)
+                        self.detection_mode = config.get("detection_mode", self.detection_mode)
+                        self.console_query_interval = config.get("console_query_interval",
+                                                                 self.console_query_interval)
+                        self.server_start_timeout = config.get("server_start_timeout", self.server_start_timeout)
+                        self.world_pool_size = config.get("world_pool_size", self.world_pool_size)
+                        self.trash_reap_rate_mb = config.get("trash_reap_rate_mb", self.trash_reap_rate_mb)
+                        self.trash_max_mb = config.get("trash_max_mb", self.trash_max_mb)
+                        self.world_cache_mb = config.get("world_cache_mb", self.world_cache_mb)
+                        self.resource_link_mode = config.get("resource_link_mode", self.resource_link_mode)
+                        self.seed_weighting = config.get("seed_weighting", self.seed_weighting)
+                        self.seed_no_repeat = config.get("seed_no_repeat", self.seed_no_repeat)
+                        self.seed_max_ready_seconds = config.get("seed_max_ready_seconds",
+                                                                 self.seed_max_ready_seconds)
+                        self.seed_max_db_mb = config.get("seed_max_db_mb", self.seed_max_db_mb)
+                        self.seed_profile_jobs = config.get("seed_profile_jobs", self.seed_profile_jobs)
+                        self.prewarm_next_server = config.get("prewarm_next_server", self.prewarm_next_server)
+                        self.prewarm_port_offset = config.get("prewarm_port_offset", self.prewarm_port_offset)
+                        self.max_sessions = config.get("max_sessions", self.max_sessions)
+                        self.session_cores = config.get("session_cores", self.session_cores)
+                        self.session_memory_mb = config.get("session_memory_mb", self.session_memory_mb)
+                        self.session_base_port = config.get("session_base_port", self.session_base_port)
                     else:
                         self.config = default_config.copy()
             else:
@@ -194,8 +2475,18 @@ class FSGSystem:
             self.add_message(f"加载配置时出错: {e}", "error")
             self.config = default_config.copy()
 
+    def _scores_changed_externally(self):
+        """数据库是否被其他程序修改过；有未写入的修改时以内存为准"""
+        if self.scores_dirty:
+            return False
+        version = self.score_store.data_version(blocking=False)
+        return version is not None and version != self.scores_data_version
+
     def load_scores(self):
-        """加载成绩"""
+        """加载成绩（已在内存中且数据库未被外部修改时直接返回）"""
+        if self.scores_loaded and not self._scores_changed_externally():
+            return
+
         default_scores = {
             "scores": [],
             "total_score": 0,
@@ -212,9 +2503,8 @@ class FSGSystem:
         }
 
         try:
-            if os.path.exists(self.scores_file):
-                with open(self.scores_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+            if not self.score_store.is_empty():
+                data = self.score_store.load(self.scores_keep_recent)
 
                 if not isinstance(data, dict):
                     self.add_message("成绩文件格式错误，使用默认值", "warning")
@@ -246,14 +2536,25 @@ class FSGSystem:
                 elif self.scores_data["current_rank"] not in [r["name"] for r in self.ranks]:
                     self.scores_data["current_rank"] = "木头III"
 
+                self.scores_saved_count = len(self.scores_data["scores"])
+                self.scores_loaded = True
+                self.scores_data_version = self.score_store.data_version()
+                self._publish_scores()
+
             else:
                 self.add_message("未找到成绩文件，创建默认成绩", "info")
                 self.scores_data = default_scores.copy()
+                self.scores_data["scores"] = []
+                self.scores_saved_count = 0
+                self.scores_loaded = True
                 self.save_scores()
 
         except Exception as e:
             self.add_message(f"加载成绩时出错: {e}", "error")
             self.scores_data = default_scores.copy()
+            self.scores_data["scores"] = []
+            self.scores_saved_count = 0
+            self._publish_scores()
 
     def save_config(self):
         """保存配置"""
@@ -267,10 +2568,11 @@ class FSGSystem:
 
     def save_scores(self):
         """保存成绩"""
-        with self.lock:
+        with self.scores_lock:
             try:
                 if not isinstance(self.scores_data, dict):
                     self.add_message("scores_data不是字典，重置为默认值", "error")
+                    self.scores_loaded = False
                     self.load_scores()
 
                 # 验证并清理数据
@@ -309,17 +2611,59 @@ class FSGSystem:
                 # 更新最后修改时间
                 cleaned_data["last_modified"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-                # 保存到文件
-                with open(self.scores_file, "w", encoding="utf-8") as f:
-                    json.dump(cleaned_data, f, ensure_ascii=False, indent=2)
-
-                self.add_message(f"成绩已保存到 {self.scores_file}", "info")
+                # 交给后台线程写入数据库
+                self.scores_data = cleaned_data
+                self.scores_dirty = True
+                self._publish_scores()
+                self.scores_flush_event.set()
                 return True
 
             except Exception as e:
                 self.add_message(f"保存成绩时出错: {e}", "error")
                 return False
 
+    def start_score_writer(self):
+        """启动成绩写入线程: 短时间内的多次保存合并为一次事务"""
+
+        def writer_loop():
+            while not self.is_closed:
+                self.scores_flush_event.wait()
+                time.sleep(self.scores_flush_delay)
+                self.scores_flush_event.clear()
+                self.flush_scores()
+
+        threading.Thread(target=writer_loop, daemon=True).start()
+
+    def flush_scores(self):
+        """把内存中尚未写入的成绩写入数据库"""
+        with self.scores_flush_lock:
+            with self.scores_lock:
+                if not self.scores_dirty:
+                    return True
+                data = {key: self.scores_data.get(key) for key in ScoreStore.AGGREGATE_KEYS}
+                data["top_scores"] = list(data.get("top_scores") or [])
+                new_records = list(self.scores_data["scores"][self.scores_saved_count:])
+                saved_count = len(self.scores_data["scores"])
+                self.scores_dirty = False
+
+            try:
+                self.score_store.save(data, new_records)
+            except Exception as e:
+                with self.scores_lock:
+                    self.scores_dirty = True
+                self.add_message(f"保存成绩时出错: {e}", "error")
+                return False
+
+            with self.scores_lock:
+                self.scores_saved_count = saved_count
+                # 已写入数据库的旧记录不再留在内存里，只保留最近几条用于显示
+                trim = min(len(self.scores_data["scores"]) - self.scores_keep_recent, self.scores_saved_count)
+                if trim > 0:
+                    del self.scores_data["scores"][:trim]
+                    self.scores_saved_count -= trim
+            logger.debug(f"成绩已保存到 {self.scores_db}")
+            return True
+
     def get_village_bonus(self, village_type, rank_type):
         """根据段位类型获取村庄加分"""
         if rank_type in ["gold", "diamond", "netherite"]:
@@ -335,8 +2679,8 @@ class FSGSystem:
         secs = int(seconds % 60)
         return f"{minutes:02d}:{secs:02d}"
 
-    def stop_server(self):
-        """强制关闭服务器"""
+    def stop_server(self, kill_strays=True):
+        """强制关闭服务器；kill_strays=False 时只按PID结束当前服务器进程（接管预热服务器时使用）"""
         try:
             if self.server_process and self.server_process.poll() is None:
                 self.server_process.terminate()
@@ -346,18 +2690,128 @@ class FSGSystem:
                     self.server_process.kill()
                 self.server_process = None
 
-            if platform.system() == "Windows":
+            # 有预热服务器时不能按进程名全部结束
+            if (platform.system() == "Windows" and kill_strays and self.kill_stray_servers
+                    and not self.warm_server and not (self.warm_thread and self.warm_thread.is_alive())):
                 subprocess.run(["taskkill", "/F", "/IM", "bedrock_server.exe"],
                                capture_output=True)
         except Exception as e:
             self.add_message(f"停止服务器时出错: {e}", "error")
 
+    def _dir_size(self, path):
+        """估算目录大小（只统计db目录，世界的绝大部分数据都在这里）"""
+        db_dir = os.path.join(path, "db")
+        total = 0
+        try:
+            for entry in os.scandir(db_dir):
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+        return total
+
+    def move_to_trash(self, path):
+        """把目录原子地重命名到回收区，成功返回True"""
+        try:
+            os.makedirs(self.world_trash_dir, exist_ok=True)
+            size = self._dir_size(path)
+            os.rename(path, os.path.join(self.world_trash_dir, uuid.uuid4().hex))
+        except OSError as e:
+            logger.warning(f"移入回收区失败，改为直接删除: {e}")
+            return False
+
+        with self.trash_lock:
+            self.trash_bytes += size
+        self.trash_pending.set()
+        return True
+
+    def start_trash_reaper(self):
+        """启动低优先级的回收区清理线程"""
+
+        def reaper_loop():
+            # Linux下可以单独降低本线程的CPU优先级，IO优先级也会随之降低
+            if hasattr(os, "setpriority") and hasattr(threading, "get_native_id"):
+                try:
+                    os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+                except OSError:
+                    pass
+
+            while not self.is_closed:
+                try:
+                    if os.path.isdir(self.world_trash_dir):
+                        for name in os.listdir(self.world_trash_dir):
+                            self._reap(os.path.join(self.world_trash_dir, name))
+                except Exception as e:
+                    logger.warning(f"清理回收区出错: {e}")
+
+                self.trash_pending.wait()
+                self.trash_pending.clear()
+
+        threading.Thread(target=reaper_loop, daemon=True).start()
+
+    def _reap(self, path):
+        """限速删除一个回收区目录；回收区超过磁盘预算时不限速"""
+        rate = self.trash_reap_rate_mb * 1024 * 1024
+        budget = self.trash_max_mb * 1024 * 1024
+        window_start = time.monotonic()
+        window_bytes = 0
+
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    size = os.lstat(file_path).st_size
+                    os.unlink(file_path)
+                except OSError:
+                    continue
+
+                with self.trash_lock:
+                    self.trash_bytes = max(0, self.trash_bytes - size)
+                    over_budget = self.trash_bytes > budget
+
+                window_bytes += size
+                if rate > 0 and not over_budget:
+                    # 按删除的字节数计算应耗费的时间，删得太快就睡一会儿
+                    ahead = window_bytes / rate - (time.monotonic() - window_start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass
+
+        try:
+            os.rmdir(path)
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def snapshot_key(self, seed, drop_rate_tier):
+        """世界快照的键，包含该掉率档位实际使用的资源包内容哈希"""
+        pack_hash = self.resource_deployer.content_hash(self.get_pack_source(drop_rate_tier))
+        return WorldSnapshotCache.make_key(seed, drop_rate_tier, self.server_version, pack_hash)
+
+    def capture_world_snapshot(self, level_dir, cache_key, meta):
+        """把已正常关闭的服务器生成的世界压缩进快照缓存
+
+        只能用于没人玩过、服务器已退出的世界：运行中的LevelDB有锁和未落盘的数据，复制出来不完整
+        """
+        try:
+            self.world_cache.store(cache_key, level_dir, meta)
+        except Exception as e:
+            logger.warning(f"保存世界快照失败: {e}")
+
     def clear_world_files(self):
         """清空世界文件"""
         try:
             bedrock_level_dir = os.path.join(self.world_dir, "Bedrock level")
 
-            if os.path.exists(bedrock_level_dir):
+            if os.path.exists(bedrock_level_dir) and self.move_to_trash(bedrock_level_dir):
+                # 旧世界已整体移入回收区，由后台线程慢慢删除
+                self.add_message("旧世界已移入回收区，后台删除中")
+                os.makedirs(bedrock_level_dir, exist_ok=True)
+            elif os.path.exists(bedrock_level_dir):
                 self.add_message(f"清理Bedrock level文件夹: {bedrock_level_dir}")
                 for item in os.listdir(bedrock_level_dir):
                     item_path = os.path.join(bedrock_level_dir, item)
@@ -372,75 +2826,178 @@ class FSGSystem:
                 self.add_message(f"Bedrock level文件夹不存在，创建: {bedrock_level_dir}")
                 os.makedirs(bedrock_level_dir, exist_ok=True)
 
+            # 新世界的数据库文件需要从头扫描
+            self.log_reader.reset()
+            self.table_reader.reset()
+
             return True
         except Exception as e:
             self.add_message(f"清理世界文件时出错: {e}", "error")
             return False
 
-    def copy_fsg_resources(self):
+    def describe_drop_rate_tier(self, drop_rate_tier):
+        if drop_rate_tier == "normal":
+            return "正常掉率"
+        return f"掉率增加({drop_rate_tier})"
+
+    def resolve_drop_rate_tier(self, increased_drop_rate, drop_rate_tier=None):
+        """把旧的"是否增加掉率"开关换算成掉率档位"""
+        if drop_rate_tier:
+            return drop_rate_tier
+        return self.pack_builder.default_tier() if increased_drop_rate else "normal"
+
+    def get_pack_source(self, drop_rate_tier):
+        """返回某个掉率档位的资源包目录，生成失败时退回手工维护的FSG_resource_packed"""
+        if drop_rate_tier == "normal":
+            return self.fsg_resource_dir
+        try:
+            return self.pack_builder.build(drop_rate_tier)
+        except UnknownDropRateTierError:
+            # 档位写错时退回手工资源包会让玩家在错误的掉率下开局
+            raise
+        except Exception as e:
+            self.add_message(f"生成掉率资源包 {drop_rate_tier} 失败，使用 {self.fsg_resource_packed_dir}: {e}",
+                             "warning")
+            return self.fsg_resource_packed_dir
+
+    def copy_fsg_resources(self, bedrock_level_dir=None, drop_rate_tier=None, announce=True):
         """复制FSG资源文件夹中的资源到Bedrock level文件夹"""
+        if drop_rate_tier is None:
+            drop_rate_tier = self.drop_rate_tier
+
         try:
-            source_dir = self.fsg_resource_packed_dir if self.increased_drop_rate else self.fsg_resource_dir
+            source_dir = self.get_pack_source(drop_rate_tier)
 
             if not os.path.exists(source_dir):
                 self.add_message(f"{source_dir}文件夹不存在", "error")
                 return False
 
-            bedrock_level_dir = os.path.join(self.world_dir, "Bedrock level")
+            if bedrock_level_dir is None:
+                bedrock_level_dir = os.path.join(self.world_dir, "Bedrock level")
             os.makedirs(bedrock_level_dir, exist_ok=True)
 
-            for item in os.listdir(source_dir):
-                src_path = os.path.join(source_dir, item)
-                dst_path = os.path.join(bedrock_level_dir, item)
+            copied, skipped, removed, errors = self.resource_deployer.deploy(source_dir, bedrock_level_dir)
+            for error in errors:
+                self.add_message(f"复制资源文件出错: {error}", "warning")
 
-                try:
-                    if os.path.isfile(src_path):
-                        shutil.copy2(src_path, dst_path)
-                    elif os.path.isdir(src_path):
-                        if os.path.exists(dst_path):
-                            shutil.rmtree(dst_path)
-                        shutil.copytree(src_path, dst_path)
-                except Exception as e:
-                    self.add_message(f"复制{item}时出错: {e}", "warning")
-                    continue
-
-            self.add_message(f"FSG资源复制完成，使用资源包: {'掉率增加' if self.increased_drop_rate else '正常掉率'}")
+            if announce:
+                self.add_message(f"FSG资源复制完成，使用资源包: {self.describe_drop_rate_tier(drop_rate_tier)} "
+                                 f"(更新{copied}个, 未变化{skipped}个, 删除{removed}个)")
             return True
         except Exception as e:
             self.add_message(f"复制FSG资源时出错: {e}", "error")
             return False
 
-    def generate_seed(self):
-        """从5个种子文件中随机选择一个种子"""
-        seed_files = {
-            "seed0.txt": "平原村",
-            "seed1.txt": "沙漠村",
-            "seed2.txt": "雪原村",
-            "seed3.txt": "云杉村",
-            "seed4.txt": "金合欢村"
-        }
+    def start_world_stager(self):
+        """启动后台预备世界线程，为每种掉率各保持 world_pool_size 个就绪世界"""
+        if self.world_pool_size <= 0 or not os.path.isdir(self.server_dir):
+            return
+
+        def stager_loop():
+            # 上次运行遗留的预备世界没有对应的种子记录，直接清掉
+            shutil.rmtree(self.world_staging_dir, ignore_errors=True)
+
+            while not self.is_closed:
+                # 只为正常掉率和默认的增加掉率档位预备世界
+                for drop_rate_tier in ("normal", self.pack_builder.default_tier()):
+                    while True:
+                        with self.world_pool_lock:
+                            if len(self.world_pool.get(drop_rate_tier, [])) >= self.world_pool_size:
+                                break
+                        if not self._stage_world(drop_rate_tier):
+                            break
+
+                self.world_pool_refill.wait()
+                self.world_pool_refill.clear()
+
+        threading.Thread(target=stager_loop, daemon=True).start()
 
-        selected_file = random.choice(list(seed_files.keys()))
-        village_type = seed_files[selected_file]
+    def _stage_world(self, drop_rate_tier):
+        """准备一个已选好种子、已放入资源包的空世界"""
+        staged_dir = os.path.join(self.world_staging_dir, f"{drop_rate_tier}_{uuid.uuid4().hex}")
+        try:
+            os.makedirs(staged_dir)
+            if not self.copy_fsg_resources(staged_dir, drop_rate_tier, announce=False):
+                shutil.rmtree(staged_dir, ignore_errors=True)
+                return False
+
+            seed, village_type = self.generate_seed(announce=False, reserve=True)
+            with self.world_pool_lock:
+                self.world_pool.setdefault(drop_rate_tier, []).append({
+                    "path": staged_dir,
+                    "seed": seed,
+                    "village_type": village_type
+                })
+            return True
+        except Exception as e:
+            logger.warning(f"预备世界失败: {e}")
+            shutil.rmtree(staged_dir, ignore_errors=True)
+            return False
+
+    def take_staged_world(self, drop_rate_tier):
+        """取出一个预备好的世界，没有时返回None"""
+        with self.world_pool_lock:
+            pool = self.world_pool.get(drop_rate_tier)
+            staged = pool.pop(0) if pool else None
+        return staged
+
+    def install_staged_world(self, staged):
+        """把旧世界移入回收区，再把预备好的世界原子地重命名为Bedrock level"""
+        bedrock_level_dir = os.path.join(self.world_dir, "Bedrock level")
+        if os.path.exists(bedrock_level_dir) and not self.move_to_trash(bedrock_level_dir):
+            shutil.rmtree(staged["path"], ignore_errors=True)
+            return False
 
         try:
-            with open(selected_file, 'r') as f:
-                seeds = [line.strip() for line in f.readlines() if line.strip()]
+            os.rename(staged["path"], bedrock_level_dir)
+            # 新世界的数据库文件需要从头扫描
+            self.log_reader.reset()
+            self.table_reader.reset()
+            self.add_message(f"已换入预备世界，资源包: {self.describe_drop_rate_tier(self.drop_rate_tier)}")
+            return True
+        except OSError as e:
+            self.add_message(f"使用预备世界失败，改为直接复制资源: {e}", "warning")
+            shutil.rmtree(staged["path"], ignore_errors=True)
+            return False
 
-            if not seeds:
-                raise ValueError(f"种子文件 {selected_file} 为空")
+    def _draw_seed(self, reserve=False):
+        if self.seed_scheduler:
+            selected_file = self.seed_index.pick_file()
+            return selected_file, self.seed_files[selected_file], self.seed_scheduler.draw(selected_file, reserve)
+        return self.seed_index.pick()
+
+    def commit_seed(self, seed):
+        """预留的种子开局后才算从牌堆中发出"""
+        if self.seed_scheduler:
+            try:
+                self.seed_scheduler.commit(seed)
+            except ValueError:
+                pass
+
+    def generate_seed(self, announce=True, reserve=False):
+        """从种子索引中随机选择一个种子，跳过性能数据超过阈值的种子
 
-            selected_seed = random.choice(seeds)
+        reserve=True 用于预备世界和预热服务器: 只预留种子，开局时再 commit_seed
+        """
+        try:
+            for _ in range(50):
+                selected_file, village_type, selected_seed = self._draw_seed(reserve)
+                if self.seed_metrics.allowed(selected_seed, self.seed_max_ready_seconds, self.seed_max_db_mb):
+                    break
+            else:
+                self.add_message("连续50个种子都超过性能阈值，使用备用种子", "warning")
+                return self.backup_seed, "未知类型"
+            selected_seed = str(selected_seed)
 
-            self.add_message(f"从 {selected_file} 中选择种子: {selected_seed}")
-            self.add_message(f"村庄类型: {village_type}")
+            if announce:
+                self.add_message(f"从 {selected_file} 中选择种子: {selected_seed}")
+                self.add_message(f"村庄类型: {village_type}")
 
             return selected_seed, village_type
 
         except Exception as e:
             self.add_message(f"读取种子文件失败: {e}", "error")
-            backup_seed = 564030617
-            return backup_seed, "未知类型"
+            return self.backup_seed, "未知类型"
 
     def update_seed_in_properties(self, seed):
         """修改server.properties中的种子"""
@@ -584,6 +3141,20 @@ class FSGSystem:
             self.add_message(f"创建server.properties失败: {e}", "error")
             return False
 
+    def is_player_key(self, key):
+        """判断数据库键是否为本地玩家或远程玩家记录"""
+        return key == b"~local_player" or key.startswith(b"player_")
+
+    def scan_entries(self, entries):
+        """检查数据库条目，只解析玩家记录的背包"""
+        for key, value in entries:
+            if not value or not self.is_player_key(key):
+                continue
+            # 先用字节查找快速排除，命中后再解析NBT确认物品确实在背包里
+            if self.target_item_bytes in value and NBTInventoryScanner.contains_item(value, self.target_item_bytes):
+                return True
+        return False
+
     def check_log_file(self):
         """检查日志文件是否包含目标物品"""
         try:
@@ -599,31 +3170,49 @@ class FSGSystem:
             if not log_files:
                 return False, None
 
-            log_files.sort(key=lambda x: x[1], reverse=True)
-            latest_log = log_files[0][0]
+            existing_paths = [path for path, _ in log_files]
+            self.log_reader.prune(existing_paths)
+            self.table_reader.prune(existing_paths)
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            target_file = os.path.join(self.mclog_dir, f"log_{timestamp}.txt")
+            # 最新的文件优先扫描，未变化的文件不会产生任何读取
+            log_files.sort(key=lambda x: x[1], reverse=True)
 
-            shutil.copy2(latest_log, target_file)
+            for file_path, _ in log_files:
+                try:
+                    if file_path.endswith('.log'):
+                        found = self.scan_entries(self.log_reader.read_entries(file_path))
+                    else:
+                        found = self.scan_entries(self.table_reader.read_new_entries(file_path))
+                except FileNotFoundError:
+                    # 扫描途中被LevelDB压缩删除
+                    self.log_reader.reset(file_path)
+                    self.table_reader.reset(file_path)
+                    continue
+                except CorruptTableError as e:
+                    # 表已写完但数据块损坏，记录一次后跳过，不再反复读取
+                    self.add_message(f"跳过损坏的表 {os.path.basename(file_path)}: {e}", "warning")
+                    self.table_reader.mark_scanned(file_path)
+                    continue
+                except ValueError:
+                    # 压缩产生的表还没写完，下次再扫描
+                    self.table_reader.reset(file_path)
+                    continue
+                except Exception as e:
+                    self.add_message(f"读取日志文件失败: {e}", "error")
+                    self.log_reader.reset(file_path)
+                    self.table_reader.reset(file_path)
+                    continue
 
-            try:
-                with open(target_file, 'rb') as f:
-                    content = f.read().decode('utf-8', errors='ignore')
+                if found:
+                    # 只有命中时才把文件复制到mclog留档
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    target_file = os.path.join(self.mclog_dir, f"log_{timestamp}.txt")
+                    shutil.copy2(file_path, target_file)
 
-                if self.target_item in content:
                     self.last_log_file = target_file
                     return True, target_file
-                else:
-                    if os.path.exists(target_file):
-                        os.remove(target_file)
-                    return False, None
 
-            except Exception as e:
-                self.add_message(f"读取日志文件失败: {e}", "error")
-                if os.path.exists(target_file):
-                    os.remove(target_file)
-                return False, None
+            return False, None
 
         except Exception as e:
             self.add_message(f"检查日志文件时出错: {e}", "error")
@@ -653,87 +3242,109 @@ class FSGSystem:
         self.is_monitoring = True
 
         def monitor_loop():
-            self.add_message(f"监控线程启动，检查间隔: {self.monitor_interval}秒")
+            console_mode = self.detection_mode == "console"
+            watcher = None
+
+            if console_mode:
+                self.console_detector = ConsoleItemDetector(self.server_process, self.server_output, self.target_item)
+                self.console_detector.start()
+                self.add_message(f"监控线程启动，通过服务器控制台查询，查询间隔: {self.console_query_interval}秒")
+            else:
+                watcher = DbDirWatcher(self.world_db_path, self.config.get("use_inotify", True))
+                if watcher.using_inotify:
+                    self.add_message(f"监控线程启动，使用inotify实时监控（兜底间隔: {self.monitor_interval}秒）")
+                else:
+                    self.add_message(f"监控线程启动，检查间隔: {self.monitor_interval}秒")
 
             while self.is_monitoring and self.current_session:
                 try:
-                    detected, log_file = self.check_log_file()
+                    if console_mode:
+                        # query会等待最多一个查询间隔
+                        detected = self.console_detector.query(self.console_query_interval)
+                        log_file = None
+                    else:
+                        detected, log_file = self.check_log_file()
 
                     if detected:
                         self.add_message("检测到目标物品，开始结算流程")
-                        self.is_monitoring = False
-
-                        if self.current_session:
-                            self.load_scores()
-
-                            raw_elapsed_seconds = time.time() - self.current_session['start_time']
-                            raw_minutes = raw_elapsed_seconds / 60
-
-                            seed = self.current_session.get('seed', '未知')
-                            village_type = self.current_session.get('village_type', '未知')
-                            increased_drop_rate = self.current_session.get('increased_drop_rate', False)
-                            pure_trial_bonus = self.current_session.get('pure_trial_bonus', 0)
-
-                            effective_seconds = max(0, raw_elapsed_seconds - 30)
-                            effective_minutes = effective_seconds / 60
-
-                            base_score = 4
-
-                            old_total_score = self.scores_data.get('total_score', 0)
-                            old_rank_info = self.get_rank_info(old_total_score)
-
-                            time_score = self.calculate_time_bonus(effective_minutes, old_rank_info['type'])
-                            village_score = self.get_village_bonus(village_type, old_rank_info['type'])
-                            pure_trial_score = pure_trial_bonus if not increased_drop_rate else 0
-
-                            total_score = base_score + time_score + village_score + pure_trial_score
-
-                            self.scores_data['total_attempts'] = self.scores_data.get('total_attempts', 0) + 1
-                            self.scores_data['successful_attempts'] = self.scores_data.get('successful_attempts', 0) + 1
-
-                            score_record = {
-                                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                'seed': seed,
-                                'village_type': village_type,
-                                'raw_time_seconds': raw_elapsed_seconds,
-                                'effective_time_seconds': effective_seconds,
-                                'effective_minutes': effective_minutes,
-                                'total_score': total_score,
-                                'base_score': base_score,
-                                'time_score': time_score,
-                                'village_score': village_score,
-                                'pure_trial_score': pure_trial_score,
-                                'old_rank_type': old_rank_info['type'],
-                                'increased_drop_rate': increased_drop_rate,
-                                'success': True
-                            }
-
-                            if 'scores' not in self.scores_data:
-                                self.scores_data['scores'] = []
-                            self.scores_data['scores'].append(score_record)
-
-                            current_best_time = self.scores_data.get('best_time')
-                            if current_best_time is None or effective_seconds < current_best_time:
-                                self.scores_data['best_time'] = effective_seconds
-                                self.scores_data['best_seed'] = seed
-                                self.scores_data['best_village_type'] = village_type
-
-                            new_total_score = old_total_score + total_score
-                            self.scores_data['total_score'] = new_total_score
-
-                            new_rank_info = self.get_rank_info(new_total_score)
-
-                            self.scores_data['current_rank'] = new_rank_info['name']
-                            self.scores_data['rank_progress'] = new_rank_info['progress_percent']
-                            if new_rank_info['is_netherite']:
-                                self.scores_data['rank_stars'] = new_rank_info['stars']
+                        self.events.publish("detection", {"item": self.target_item,
+                                                          "seed": self.current_session.get('seed')})
+                        self.is_monitoring = False
 
-                            self.save_scores()
+                        if self.current_session:
+                            with self.scores_lock:
+                                self.load_scores()
+
+                                raw_elapsed_seconds = time.time() - self.current_session['start_time']
+                                raw_minutes = raw_elapsed_seconds / 60
+
+                                seed = self.current_session.get('seed', '未知')
+                                village_type = self.current_session.get('village_type', '未知')
+                                increased_drop_rate = self.current_session.get('increased_drop_rate', False)
+                                drop_rate_tier = self.current_session.get('drop_rate_tier', "normal")
+                                pure_trial_bonus = self.current_session.get('pure_trial_bonus', 0)
+
+                                effective_seconds = max(0, raw_elapsed_seconds - 30)
+                                effective_minutes = effective_seconds / 60
+
+                                base_score = 4
+
+                                old_total_score = self.scores_data.get('total_score', 0)
+                                old_rank_info = self.get_rank_info(old_total_score)
+
+                                time_score = self.calculate_time_bonus(effective_minutes, old_rank_info['type'])
+                                village_score = self.get_village_bonus(village_type, old_rank_info['type'])
+                                pure_trial_score = pure_trial_bonus if not increased_drop_rate else 0
+
+                                total_score = base_score + time_score + village_score + pure_trial_score
+
+                                self.scores_data['total_attempts'] = self.scores_data.get('total_attempts', 0) + 1
+                                self.scores_data['successful_attempts'] = self.scores_data.get('successful_attempts', 0) + 1
+
+                                score_record = {
+                                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                    'seed': seed,
+                                    'village_type': village_type,
+                                    'raw_time_seconds': raw_elapsed_seconds,
+                                    'effective_time_seconds': effective_seconds,
+                                    'effective_minutes': effective_minutes,
+                                    'total_score': total_score,
+                                    'base_score': base_score,
+                                    'time_score': time_score,
+                                    'village_score': village_score,
+                                    'pure_trial_score': pure_trial_score,
+                                    'old_rank_type': old_rank_info['type'],
+                                    'increased_drop_rate': increased_drop_rate,
+                                    'drop_rate_tier': drop_rate_tier,
+                                    'success': True
+                                }
+
+                                if 'scores' not in self.scores_data:
+                                    self.scores_data['scores'] = []
+                                self.scores_data['scores'].append(score_record)
+
+                                current_best_time = self.scores_data.get('best_time')
+                                if current_best_time is None or effective_seconds < current_best_time:
+                                    self.scores_data['best_time'] = effective_seconds
+                                    self.scores_data['best_seed'] = seed
+                                    self.scores_data['best_village_type'] = village_type
+
+                                new_total_score = old_total_score + total_score
+                                self.scores_data['total_score'] = new_total_score
+
+                                new_rank_info = self.get_rank_info(new_total_score)
+
+                                self.scores_data['current_rank'] = new_rank_info['name']
+                                self.scores_data['rank_progress'] = new_rank_info['progress_percent']
+                                if new_rank_info['is_netherite']:
+                                    self.scores_data['rank_stars'] = new_rank_info['stars']
+
+                                self.save_scores()
 
                             time_display = self.format_time_display(effective_seconds)
                             raw_time_display = self.format_time_display(raw_elapsed_seconds)
 
-                            drop_rate_status = "增加掉率" if increased_drop_rate else "正常掉率"
+                            drop_rate_status = self.describe_drop_rate_tier(drop_rate_tier)
 
                             result_msg = f"""FSG挑战完成！🎉
 种子: {seed}
@@ -758,16 +3369,27 @@ class FSGSystem:
 服务器将在60秒后关闭..."""
 
                             self.add_message(result_msg)
+                            self.events.publish("settlement", dict(score_record, message=result_msg))
 
                             self.start_shutdown_timer(60)
+                            if watcher:
+                                watcher.close()
+                            if console_mode:
+                                self.console_detector.stop()
                             return
 
-                    time.sleep(self.monitor_interval)
+                    # 有写入/重命名事件时立即返回，否则最多等待一个检查间隔
+                    if watcher:
+                        watcher.wait(self.monitor_interval)
 
                 except Exception as e:
                     self.add_message(f"监控循环出错: {e}", "error")
                     time.sleep(self.monitor_interval)
 
+            if watcher:
+                watcher.close()
+            if console_mode:
+                self.console_detector.stop()
             self.add_message("监控线程结束")
             self.is_monitoring = False
 
@@ -919,6 +3541,7 @@ class FSGSystem:
         def countdown():
             remaining = total_seconds
             while remaining > 0 and self.is_shutting_down:
+                self.events.publish("countdown", {"remaining": remaining})
                 if remaining <= 5 or remaining % 10 == 0:
                     self.add_message(f"服务器将在 {remaining} 秒后关闭...")
                 time.sleep(1)
@@ -943,39 +3566,302 @@ class FSGSystem:
 
         self.stop_server()
 
-        if self.current_session:
-            self.current_session['waiting_shutdown'] = True
+        self.update_session(waiting_shutdown=True)
 
         self.add_message("服务器已关闭，FSG模式结束")
         self.add_message("现在可以开始新的挑战")
 
         self.current_session = None
 
+    def set_server_dir(self, server_dir):
+        """切换当前使用的服务器目录，并更新相关路径"""
+        self.server_dir = server_dir
+        self.server_properties = os.path.join(self.server_dir, "server.properties")
+        self.bedrock_server_exe = os.path.join(self.server_dir, "bedrock_server.exe")
+        self.world_dir = os.path.join(self.server_dir, "worlds")
+        self.server_log_file = os.path.join(self.server_dir, "logs", "latest.log")
+
+        # 世界数据库路径
+        self.world_db_path = os.path.join(self.world_dir, "Bedrock level", "db")
+
+    def _ensure_server_copy(self, server_dir, port=None):
+        """备用服务器目录不存在时从主目录复制（程序文件用硬链接，配置文件单独复制）"""
+        primary_dir = self.server_dirs[0]
+        if server_dir == primary_dir or os.path.exists(os.path.join(server_dir, "bedrock_server.exe")):
+            return
+
+        self.add_message(f"创建备用服务器目录: {server_dir}")
+        shutil.rmtree(server_dir, ignore_errors=True)
+        shutil.copytree(primary_dir, server_dir, copy_function=copy_server_file,
+                        ignore=shutil.ignore_patterns("worlds"))
+
+        if port is None:
+            port = self.get_server_port(os.path.join(primary_dir, "server.properties")) + self.prewarm_port_offset
+        write_server_properties(os.path.join(server_dir, "server.properties"),
+                                {"server-port": str(port), "server-portv6": str(port + 1)})
+
+    @staticmethod
+    def _can_restore_nice():
+        """接管后能否把nice值调回0: 需要root，或 RLIMIT_NICE 允许（软限制 >= 20）"""
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            return True
+        if resource is None or not hasattr(resource, "RLIMIT_NICE"):
+            return False
+        soft, _ = resource.getrlimit(resource.RLIMIT_NICE)
+        return soft == resource.RLIM_INFINITY or soft >= 20
+
+    def _low_priority_options(self):
+        """预热服务器的启动参数: 低优先级运行，接管时再恢复"""
+        if os.name == "nt":
+            return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+        if self._can_restore_nice():
+            return {"preexec_fn": lambda: os.nice(10)}
+        # 调低后没有权限调回来，接管后会一直低优先级运行，宁可不调
+        return {}
+
+    def _restore_priority(self, process):
+        """预热服务器接管后恢复正常优先级"""
+        try:
+            if os.name == "nt":
+                PROCESS_SET_INFORMATION = 0x0200
+                NORMAL_PRIORITY_CLASS = 0x20
+                kernel32 = ctypes.windll.kernel32
+                kernel32.OpenProcess.restype = ctypes.c_void_p
+                handle = kernel32.OpenProcess(PROCESS_SET_INFORMATION, False, process.pid)
+                if not handle:
+                    raise ctypes.WinError()
+                try:
+                    kernel32.SetPriorityClass(ctypes.c_void_p(handle), NORMAL_PRIORITY_CLASS)
+                finally:
+                    kernel32.CloseHandle(ctypes.c_void_p(handle))
+            elif os.getpriority(os.PRIO_PROCESS, process.pid) != 0:
+                os.setpriority(os.PRIO_PROCESS, process.pid, 0)
+        except (OSError, AttributeError) as e:
+            self.add_message(f"恢复服务器优先级失败: {e}", "warning")
+
+    def prepare_warm_server(self):
+        """当前对局进行时，在备用目录和备用端口上用低优先级启动下一局的服务器"""
+        if not self.prewarm_next_server or self.warm_server or (self.warm_thread and self.warm_thread.is_alive()):
+            return
+
+        drop_rate_tier = self.drop_rate_tier
+        server_dir = next(d for d in self.server_dirs if d != self.server_dir)
+
+        def run():
+            try:
+                self._ensure_server_copy(server_dir)
+
+                world_dir = os.path.join(server_dir, "worlds")
+                bedrock_level_dir = os.path.join(world_dir, "Bedrock level")
+                if os.path.exists(bedrock_level_dir) and not self.move_to_trash(bedrock_level_dir):
+                    shutil.rmtree(bedrock_level_dir, ignore_errors=True)
+                os.makedirs(world_dir, exist_ok=True)
+
+                staged = self.take_staged_world(drop_rate_tier)
+                if staged:
+                    seed, village_type = staged["seed"], staged["village_type"]
+                    os.rename(staged["path"], bedrock_level_dir)
+                else:
+                    seed, village_type = self.generate_seed(announce=False, reserve=True)
+                    if not self.copy_fsg_resources(bedrock_level_dir, drop_rate_tier, announce=False):
+                        return
+                self.world_pool_refill.set()
+
+                if self.world_cache:
+                    self.world_cache.restore(self.snapshot_key(seed, drop_rate_tier), bedrock_level_dir)
+
+                properties = os.path.join(server_dir, "server.properties")
+                write_server_properties(properties, {"level-seed": str(seed)})
+
+                ready_event = threading.Event()
+
+                def on_output(entry):
+                    if not ready_event.is_set() and self.server_ready_text in entry["message"]:
+                        ready_event.set()
+                        self.bump_state_version()
+
+                output = ServerOutputPump(2000)
+                output.add_listener(on_output)
+                process = subprocess.Popen(
+                    [os.path.join(server_dir, "bedrock_server.exe")],
+                    cwd=server_dir,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    errors="replace",
+                    bufsize=1,
+                    **self._low_priority_options()
+                )
+                output.attach(process)
+
+                warm = {
+                    "process": process,
+                    "output": output,
+                    "ready": ready_event,
+                    "server_dir": server_dir,
+                    "port": self.get_server_port(properties),
+                    "seed": seed,
+                    "village_type": village_type,
+                    "drop_rate_tier": drop_rate_tier
+                }
+                with self.warm_lock:
+                    self.warm_server = warm
+                self.bump_state_version()
+                self.add_message(f"下一局的服务器正在后台预热（端口 {warm['port']}）")
+            except Exception as e:
+                self.add_message(f"预热下一局服务器失败: {e}", "warning")
+
+        self.warm_thread = threading.Thread(target=run, daemon=True)
+        self.warm_thread.start()
+
+    def discard_warm_server(self):
+        """关闭预热服务器"""
+        with self.warm_lock:
+            warm, self.warm_server = self.warm_server, None
+        if not warm:
+            return
+        self.bump_state_version()
+
+        process = warm["process"]
+        try:
+            if process.poll() is None:
+                process.stdin.write("stop\n")
+                process.stdin.flush()
+                process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+
+    def take_warm_server(self, drop_rate_tier):
+        """取出可以接管的预热服务器；掉率档位不符或进程已退出时将其关闭"""
+        with self.warm_lock:
+            warm = self.warm_server
+        if not warm:
+            return None
+
+        if warm["drop_rate_tier"] != drop_rate_tier or warm["process"].poll() is not None:
+            self.discard_warm_server()
+            return None
+
+        with self.warm_lock:
+            self.warm_server = None
+        self.bump_state_version()
+        return warm
+
+    def promote_warm_server(self, warm):
+        """停止旧服务器，让预热好的服务器成为当前服务器"""
+        self.add_message("接管预热服务器")
+        self.startup_timings = MappingProxyType({})
+        phase_start = time.monotonic()
+        previous_port = self.get_server_port()
+
+        # 只按PID结束旧服务器，按进程名结束会把要接管的预热服务器一起杀掉
+        self.stop_server(kill_strays=False)
+        self.cancel_shutdown_timer()
+        phase_start = self._record_phase("停止服务器", phase_start)
+
+        self.set_server_dir(warm["server_dir"])
+        self.server_process = warm["process"]
+        self._restore_priority(self.server_process)
+        warm["output"].relay_to(self.server_output)
+        self.log_reader.reset()
+        self.table_reader.reset()
+
+        # 预热服务器可能还没生成完世界
+        deadline = time.monotonic() + self.server_start_timeout
+        while not warm["ready"].wait(0.05):
+            if self.server_process.poll() is not None or time.monotonic() > deadline:
+                self.add_message("预热服务器未能就绪", "error")
+                self.stop_server(kill_strays=False)
+                return False
+        self._record_phase("服务器就绪", phase_start)
+
+        # 运行中的服务器无法换端口，预热服务器只能用备用端口，两个目录轮流使用时端口也来回切换
+        if warm["port"] != previous_port:
+            self.add_message(f"注意: 本局服务器端口从 {previous_port} 变为 {warm['port']}，"
+                             f"请在游戏中改连端口 {warm['port']}", "warning")
+        return True
+
+    def _record_phase(self, phase, phase_start):
+        """记录一个启动阶段的耗时，返回下一阶段的起点"""
+        now = time.monotonic()
+        # 整体替换为新的只读字典，get_status 在其他线程读取时不会遇到正在修改的字典
+        self.startup_timings = MappingProxyType({**self.startup_timings, phase: round(now - phase_start, 2)})
+        self.bump_state_version()
+        return now
+
+    def get_server_port(self, properties=None):
+        """从server.properties读取IPv4端口"""
+        try:
+            with open(properties or self.server_properties, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip().startswith('server-port='):
+                        return int(line.strip().split('=', 1)[1])
+        except (OSError, ValueError):
+            pass
+        return 19132
+
+    def wait_for_server_ready(self, ready_event, launch_time):
+        """等待服务器输出"Server started."，同时记录各阶段耗时"""
+        deadline = launch_time + self.server_start_timeout
+        phase_start = launch_time
+        world_created = False
+
+        while time.monotonic() < deadline:
+            if ready_event.wait(0.05):
+                self._record_phase("服务器就绪", phase_start)
+                return True
+
+            if self.server_process.poll() is not None:
+                return False
+
+            if not world_created and os.path.isdir(self.world_db_path):
+                world_created = True
+                phase_start = self._record_phase("生成世界", phase_start)
+
+        return False
+
     def start_server(self):
         """启动服务器"""
+        ready_event = threading.Event()
+
+        def on_server_line(entry):
+            if self.server_ready_text in entry["message"]:
+                ready_event.set()
+
+        self.server_output.add_listener(on_server_line)
         try:
             if not os.path.exists(self.bedrock_server_exe):
                 self.add_message(f"找不到bedrock_server.exe！请检查路径: {self.bedrock_server_exe}", "error")
                 return False
 
             self.add_message(f"正在启动服务器: {self.bedrock_server_exe}")
+            launch_time = time.monotonic()
             self.server_process = subprocess.Popen(
                 [self.bedrock_server_exe],
                 cwd=self.server_dir,
+                stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True,
+                errors="replace",
                 bufsize=1,
                 universal_newlines=True
             )
 
-            self.add_message("服务器启动中，请稍候...")
+            # 持续读取输出，避免管道写满后服务器阻塞
+            self.server_output.attach(self.server_process)
 
-            time.sleep(3)
+            self.add_message("服务器启动中，请稍候...")
 
-            if self.server_process.poll() is not None:
-                stdout, stderr = self.server_process.communicate()
-                error_msg = stderr if stderr else "服务器进程异常退出"
+            if not self.wait_for_server_ready(ready_event, launch_time):
+                if self.server_process.poll() is not None:
+                    stderr_lines = [line["message"] for line in self.server_output.get_lines()
+                                    if line["stream"] == "stderr"]
+                    error_msg = stderr_lines[-1] if stderr_lines else "服务器进程异常退出"
+                else:
+                    error_msg = f"{self.server_start_timeout}秒内未就绪"
+                    self.stop_server()
                 self.add_message(f"服务器启动失败: {error_msg}", "error")
                 return False
 
@@ -985,8 +3871,10 @@ class FSGSystem:
         except Exception as e:
             self.add_message(f"服务器启动失败: {e}", "error")
             return False
+        finally:
+            self.server_output.remove_listener(on_server_line)
 
-    def start_fsg(self, increased_drop_rate=False):
+    def start_fsg(self, increased_drop_rate=False, drop_rate_tier=None):
         """开始新的FSG挑战"""
         if self.current_session:
             if self.current_session.get('waiting_shutdown', False):
@@ -1002,8 +3890,14 @@ class FSGSystem:
                 return False
 
         # 设置掉率参数
-        self.increased_drop_rate = increased_drop_rate
-        self.pure_trial_bonus = 0 if increased_drop_rate else 2
+        drop_rate_tier = self.resolve_drop_rate_tier(increased_drop_rate, drop_rate_tier)
+        if drop_rate_tier != "normal" and drop_rate_tier not in self.pack_builder.tier_names():
+            self.add_message(f"未知的掉率档位: {drop_rate_tier}", "error")
+            return False
+
+        self.drop_rate_tier = drop_rate_tier
+        self.increased_drop_rate = drop_rate_tier != "normal"
+        self.pure_trial_bonus = 0 if self.increased_drop_rate else 2
 
         self.add_message("正在准备FSG挑战...")
 
@@ -1015,37 +3909,62 @@ class FSGSystem:
         """继续FSG启动流程"""
         self.clear_mclog_directory()
 
-        seed, village_type = self.generate_seed()
+        warm = self.take_warm_server(self.drop_rate_tier)
+        if warm:
+            self._start_on_warm_server(warm)
+            return
+
+        staged = self.take_staged_world(self.drop_rate_tier)
+        if staged:
+            seed, village_type = staged["seed"], staged["village_type"]
+        else:
+            seed, village_type = self.generate_seed()
 
         self.add_message(f"生成种子: {seed}")
         self.add_message(f"村庄类型: {village_type}")
         self.add_message(
-            f"掉率设置: {'增加' if self.increased_drop_rate else '正常'} (纯粹试炼: +{self.pure_trial_bonus}分)")
+            f"掉率设置: {self.describe_drop_rate_tier(self.drop_rate_tier)} (纯粹试炼: +{self.pure_trial_bonus}分)")
         self.add_message("正在准备服务器...")
 
+        self.startup_timings = MappingProxyType({})
+        phase_start = time.monotonic()
+
         # 1. 强制关闭现有服务器
         self.add_message("步骤1: 停止现有服务器")
         self.stop_server()
         self.cancel_shutdown_timer()
+        phase_start = self._record_phase("停止服务器", phase_start)
 
         # 2. 修改服务器种子
         self.add_message(f"步骤2: 修改服务器种子为 {seed}")
         if not self.update_seed_in_properties(seed):
             self.add_message("修改服务器配置失败！", "error")
             return
+        phase_start = self._record_phase("修改种子", phase_start)
 
-        # 3. 清理世界文件
-        self.add_message("步骤3: 清理世界文件")
-        self.clear_world_files()
-
-        # 4. 复制FSG资源文件
-        self.add_message("步骤4: 复制FSG资源文件")
-        if not self.copy_fsg_resources():
-            self.add_message("复制资源文件失败！", "error")
-            return
+        # 3. 有预备世界时旧世界移入回收区、预备世界直接换入，否则清理世界文件并复制FSG资源
+        if staged and self.install_staged_world(staged):
+            self.add_message("步骤3: 换入预备世界")
+            phase_start = self._record_phase("换入预备世界", phase_start)
+        else:
+            self.add_message("步骤3: 清理世界文件")
+            self.clear_world_files()
+            phase_start = self._record_phase("清理世界", phase_start)
+
+            self.add_message("步骤4: 复制FSG资源文件")
+            if not self.copy_fsg_resources():
+                self.add_message("复制资源文件失败！", "error")
+                return
+            phase_start = self._record_phase("复制资源", phase_start)
+
+        # 命中世界快照时直接恢复，省去服务器生成世界的时间
+        if self.world_cache:
+            snapshot_key = self.snapshot_key(seed, self.drop_rate_tier)
+            if self.world_cache.restore(snapshot_key, os.path.join(self.world_dir, "Bedrock level")):
+                self.add_message("已从缓存恢复该种子的世界快照")
+                self._record_phase("恢复快照", phase_start)
 
         # 5. 创建新会话
-        time.sleep(3)
         self.current_session = {
             'seed': seed,
             'start_time': time.time(),
@@ -1054,53 +3973,176 @@ class FSGSystem:
             'waiting_shutdown': False,
             'village_type': village_type,
             'increased_drop_rate': self.increased_drop_rate,
+            'drop_rate_tier': self.drop_rate_tier,
             'pure_trial_bonus': self.pure_trial_bonus
         }
 
         # 6. 启动服务器
-        time.sleep(3)
         self.add_message("步骤5: 启动服务器")
 
         if not self.start_server():
             self.current_session = None
             return
+        self.commit_seed(seed)
 
         self.add_message("计时已启动。")
         self.add_message("服务器已启动成功")
+        self.add_message("启动耗时: " + ", ".join(
+            f"{phase} {seconds:.2f}秒" for phase, seconds in self.startup_timings.items()))
 
         # 启动日志监控
         self.start_log_monitor()
 
         self.add_message("自动检测已启动，正在监控游戏进度...请立刻开始游戏！")
 
+        # 会话开始后再补充预备世界，避免和启动抢磁盘
+        self.world_pool_refill.set()
+        self.prepare_warm_server()
+
+    def _start_on_warm_server(self, warm):
+        """用预热好的服务器开始新一局"""
+        seed, village_type = warm["seed"], warm["village_type"]
+        self.add_message(f"生成种子: {seed}")
+        self.add_message(f"村庄类型: {village_type}")
+        self.add_message(
+            f"掉率设置: {self.describe_drop_rate_tier(self.drop_rate_tier)} (纯粹试炼: +{self.pure_trial_bonus}分)")
+
+        if not self.promote_warm_server(warm):
+            return
+        self.commit_seed(seed)
+
+        self.current_session = {
+            'seed': seed,
+            'start_time': time.time(),
+            'elapsed_seconds': 0,
+            'completed': False,
+            'waiting_shutdown': False,
+            'village_type': village_type,
+            'increased_drop_rate': self.increased_drop_rate,
+            'drop_rate_tier': self.drop_rate_tier,
+            'pure_trial_bonus': self.pure_trial_bonus
+        }
+
+        self.add_message("计时已启动。")
+        self.add_message("启动耗时: " + ", ".join(
+            f"{phase} {seconds:.2f}秒" for phase, seconds in self.startup_timings.items()))
+
+        self.start_log_monitor()
+        self.add_message("自动检测已启动，正在监控游戏进度...请立刻开始游戏！")
+        self.prepare_warm_server()
+
+    def profile_seeds(self, limit=None, only_missing=True):
+        """后台批量测量种子的生成耗时、db大小和峰值内存"""
+        if self.seed_profiler:
+            self.add_message("种子性能测量已在进行中", "warning")
+            return False
+        if not os.path.exists(self.bedrock_server_exe):
+            self.add_message(f"找不到bedrock_server.exe！请检查路径: {self.bedrock_server_exe}", "error")
+            return False
+
+        self.seed_index.refresh()
+        seeds = [(filename, seed) for filename in self.seed_files for seed in self.seed_index.seeds.get(filename, ())
+                 if not (only_missing and self.seed_metrics.get(seed))]
+        if limit:
+            seeds = seeds[:limit]
+
+        self.seed_profiler = SeedProfiler(self.server_dir, os.path.basename(self.bedrock_server_exe),
+                                          os.path.join(os.path.dirname(self.server_dir), "seed_profile"),
+                                          self.server_ready_text, self.server_start_timeout,
+                                          self.seed_profile_jobs or None)
+        self.seed_profile_progress = {"total": len(seeds), "done": 0, "failed": 0}
+        self.add_message(f"开始测量 {len(seeds)} 个种子，并行实例数: {self.seed_profiler.jobs}")
+
+        progress_lock = threading.Lock()
+
+        def on_result(seed, result):
+            result["server_version"] = self.server_version
+            self.seed_metrics.record(seed, result)
+            with progress_lock:
+                self.seed_profile_progress["done"] += 1
+                if not result.get("ok"):
+                    self.seed_profile_progress["failed"] += 1
+
+        def keep_world(seed, level_dir):
+            # 测量用的世界没人玩过且服务器已正常关闭，顺便存为世界快照
+            if self.world_cache:
+                self.capture_world_snapshot(level_dir, self.snapshot_key(seed, "normal"), {
+                    "seed": str(seed),
+                    "drop_rate_tier": "normal",
+                    "server_version": self.server_version
+                })
+
+        def run():
+            try:
+                self.seed_profiler.run(
+                    seeds, lambda level_dir: self.copy_fsg_resources(level_dir, "normal", announce=False),
+                    on_result, keep_world)
+                progress = self.seed_profile_progress
+                self.add_message(f"种子测量结束: 完成 {progress['done']}/{progress['total']}，失败 {progress['failed']}")
+            finally:
+                self.seed_profiler = None
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def cancel_seed_profiling(self):
+        if self.seed_profiler:
+            self.seed_profiler.stop()
+
+    def status_payload(self):
+        """/api/status 和状态推送使用的完整状态（含段位信息）"""
+        status = self.get_status()
+
+        # 添加段位信息
+        current_score = self.scores_snapshot["total_score"]
+        rank_info = self.get_rank_info(current_score)
+
+        status['rank_info'] = {
+            'current_rank': self.format_rank_display(current_score),
+            'rank_progress': rank_info['progress_percent'],
+            'total_score': current_score
+        }
+        # 每次启动不同，页面据此发现服务端重启（消息id会从头开始）
+        status['server_id'] = self.etag_prefix
+        return status
+
     def get_status(self):
-        """获取FSG状态"""
-        if not self.current_session:
+        """获取FSG状态（只读取会话和成绩快照，不加锁）"""
+        session = self.session_snapshot
+        if not session:
             return {
                 "active": False,
                 "message": "没有正在进行的FSG挑战"
             }
 
-        elapsed = time.time() - self.current_session['start_time']
+        elapsed = time.time() - session['start_time']
         minutes = elapsed / 60
 
-        current_score = self.scores_data.get('total_score', 0)
+        current_score = self.scores_snapshot["total_score"]
         rank_info = self.get_rank_info(current_score)
+        # 预热服务器可能同时被接管或丢弃，只读一次
+        with self.warm_lock:
+            warm = self.warm_server
 
         status = {
             "active": True,
-            "seed": self.current_session['seed'],
-            "village_type": self.current_session['village_type'],
+            "seed": session['seed'],
+            "village_type": session['village_type'],
+            "started_at": session['start_time'],
             "elapsed_minutes": round(minutes, 1),
             "elapsed_seconds": int(elapsed),
             "current_rank": self.format_rank_display(current_score),
             "rank_progress": rank_info['progress_percent'],
             "monitoring": self.is_monitoring,
-            "increased_drop_rate": self.current_session.get('increased_drop_rate', False),
-            "pure_trial_bonus": self.current_session.get('pure_trial_bonus', 0)
+            "increased_drop_rate": session.get('increased_drop_rate', False),
+            "drop_rate_tier": session.get('drop_rate_tier', "normal"),
+            "pure_trial_bonus": session.get('pure_trial_bonus', 0),
+            "startup_timings": dict(self.startup_timings),
+            "server_port": self.get_server_port(),
+            "warm_server_ready": bool(warm and warm["ready"].is_set())
         }
 
-        if self.current_session.get('completed', False):
+        if session.get('completed', False):
             if self.is_shutting_down:
                 status["state"] = "挑战完成，等待服务器关闭..."
             else:
@@ -1146,60 +4188,63 @@ class FSGSystem:
     def _fail_fsg_challenge(self, rank_info, is_gold_plus=True):
         """处理FSG失败结算"""
         try:
-            self.load_scores()
-
-            seed = self.current_session.get('seed', '未知')
-            village_type = self.current_session.get('village_type', '未知')
-            increased_drop_rate = self.current_session.get('increased_drop_rate', False)
-            pure_trial_bonus = self.current_session.get('pure_trial_bonus', 0)
-
-            old_total_score = self.scores_data.get('total_score', 0)
-            old_rank_info = self.get_rank_info(old_total_score)
-
-            if is_gold_plus:
-                penalty_score = -4
-                village_score = self.get_village_bonus(village_type, old_rank_info['type'])
-                pure_trial_score = pure_trial_bonus if not increased_drop_rate else 0
-                total_score = penalty_score + village_score + pure_trial_score
-            else:
-                penalty_score = 0
-                village_score = 0
-                pure_trial_score = 0
-                total_score = 0
-
-            self.scores_data['total_attempts'] = self.scores_data.get('total_attempts', 0) + 1
-
-            fail_record = {
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'seed': seed,
-                'village_type': village_type,
-                'total_score': total_score,
-                'penalty_score': penalty_score,
-                'village_score': village_score,
-                'pure_trial_score': pure_trial_score,
-                'old_rank_type': old_rank_info['type'],
-                'increased_drop_rate': increased_drop_rate,
-                'success': False,
-                'is_gold_plus': is_gold_plus
-            }
+            with self.scores_lock:
+                self.load_scores()
+
+                seed = self.current_session.get('seed', '未知')
+                village_type = self.current_session.get('village_type', '未知')
+                increased_drop_rate = self.current_session.get('increased_drop_rate', False)
+                drop_rate_tier = self.current_session.get('drop_rate_tier', "normal")
+                pure_trial_bonus = self.current_session.get('pure_trial_bonus', 0)
+
+                old_total_score = self.scores_data.get('total_score', 0)
+                old_rank_info = self.get_rank_info(old_total_score)
+
+                if is_gold_plus:
+                    penalty_score = -4
+                    village_score = self.get_village_bonus(village_type, old_rank_info['type'])
+                    pure_trial_score = pure_trial_bonus if not increased_drop_rate else 0
+                    total_score = penalty_score + village_score + pure_trial_score
+                else:
+                    penalty_score = 0
+                    village_score = 0
+                    pure_trial_score = 0
+                    total_score = 0
+
+                self.scores_data['total_attempts'] = self.scores_data.get('total_attempts', 0) + 1
+
+                fail_record = {
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'seed': seed,
+                    'village_type': village_type,
+                    'total_score': total_score,
+                    'penalty_score': penalty_score,
+                    'village_score': village_score,
+                    'pure_trial_score': pure_trial_score,
+                    'old_rank_type': old_rank_info['type'],
+                    'increased_drop_rate': increased_drop_rate,
+                    'drop_rate_tier': drop_rate_tier,
+                    'success': False,
+                    'is_gold_plus': is_gold_plus
+                }
 
-            if 'scores' not in self.scores_data:
-                self.scores_data['scores'] = []
-            self.scores_data['scores'].append(fail_record)
+                if 'scores' not in self.scores_data:
+                    self.scores_data['scores'] = []
+                self.scores_data['scores'].append(fail_record)
 
-            new_total_score = old_total_score + total_score
-            self.scores_data['total_score'] = new_total_score
+                new_total_score = old_total_score + total_score
+                self.scores_data['total_score'] = new_total_score
 
-            new_rank_info = self.get_rank_info(new_total_score)
+                new_rank_info = self.get_rank_info(new_total_score)
 
-            self.scores_data['current_rank'] = new_rank_info['name']
-            self.scores_data['rank_progress'] = new_rank_info['progress_percent']
-            if new_rank_info['is_netherite']:
-                self.scores_data['rank_stars'] = new_rank_info['stars']
+                self.scores_data['current_rank'] = new_rank_info['name']
+                self.scores_data['rank_progress'] = new_rank_info['progress_percent']
+                if new_rank_info['is_netherite']:
+                    self.scores_data['rank_stars'] = new_rank_info['stars']
 
-            self.save_scores()
+                self.save_scores()
 
-            drop_rate_status = "增加掉率" if increased_drop_rate else "正常掉率"
+            drop_rate_status = self.describe_drop_rate_tier(drop_rate_tier)
 
             fail_msg = f"""FSG挑战失败
 种子: {seed}
@@ -1218,6 +4263,7 @@ class FSGSystem:
 {self.get_rank_progress_bar(new_rank_info['progress_percent'])} ({int(new_rank_info['progress_percent'])}%)"""
 
             self.add_message(fail_msg)
+            self.events.publish("settlement", dict(fail_record, message=fail_msg))
 
             self.is_monitoring = False
             self.stop_server()
@@ -1227,60 +4273,441 @@ class FSGSystem:
         except Exception as e:
             self.add_message(f"失败结算出错: {e}", "error")
 
+    def refresh_scores_snapshot(self):
+        """数据库被外部修改过（或还没有快照）时重新加载成绩"""
+        if self.scores_snapshot is None or self._scores_changed_externally():
+            with self.scores_lock:
+                self.load_scores()
+
     def show_scores(self):
-        """获取成绩排行榜"""
-        with self.lock:
-            self.load_scores()
+        """获取成绩排行榜（读取快照；数据库被外部修改过时先重新加载）"""
+        self.refresh_scores_snapshot()
+        return dict(self.scores_snapshot)
 
-            total_score = self.scores_data.get('total_score', 0)
-            rank_info = self.get_rank_info(total_score)
+    def _publish_scores(self):
+        """根据 scores_data 重新生成排行榜快照，调用方需持有 scores_lock"""
+        total_score = self.scores_data.get('total_score', 0)
+        rank_info = self.get_rank_info(total_score)
 
-            progress_bar = self.get_rank_progress_bar(rank_info['progress_percent'])
+        progress_bar = self.get_rank_progress_bar(rank_info['progress_percent'])
 
-            # 最近成绩
-            recent_scores = []
-            scores_list = self.scores_data.get('scores', [])
-            valid_scores = [s for s in scores_list if isinstance(s, dict)]
+        # 最近成绩
+        recent_scores = []
+        scores_list = self.scores_data.get('scores', [])
+        valid_scores = [s for s in scores_list if isinstance(s, dict)]
 
-            if valid_scores:
-                recent_scores = valid_scores[-5:][::-1]
+        if valid_scores:
+            recent_scores = valid_scores[-5:][::-1]
 
-            # 最佳成绩
-            best_scores = []
-            top_scores = self.scores_data.get('top_scores', [])
-            valid_top_scores = [s for s in top_scores if isinstance(s, dict)]
+        # 最佳成绩
+        best_scores = []
+        top_scores = self.scores_data.get('top_scores', [])
+        valid_top_scores = [s for s in top_scores if isinstance(s, dict)]
 
-            if valid_top_scores:
-                best_scores = valid_top_scores[:3]
+        if valid_top_scores:
+            best_scores = valid_top_scores[:3]
 
-            total_attempts = self.scores_data.get('total_attempts', 0)
-            successful_attempts = self.scores_data.get('successful_attempts', 0)
-            success_rate = (successful_attempts / total_attempts * 100) if total_attempts > 0 else 0
+        total_attempts = self.scores_data.get('total_attempts', 0)
+        successful_attempts = self.scores_data.get('successful_attempts', 0)
+        success_rate = (successful_attempts / total_attempts * 100) if total_attempts > 0 else 0
 
-            return {
-                "total_score": total_score,
-                "current_rank": self.format_rank_display(total_score),
-                "rank_progress": rank_info['progress_percent'],
-                "progress_bar": progress_bar,
-                "total_attempts": total_attempts,
-                "successful_attempts": successful_attempts,
-                "success_rate": round(success_rate, 1),
-                "best_time": self.scores_data.get('best_time'),
-                "best_seed": self.scores_data.get('best_seed'),
-                "best_village_type": self.scores_data.get('best_village_type'),
-                "recent_scores": recent_scores,
-                "best_scores": best_scores
-            }
+        self.scores_snapshot = MappingProxyType({
+            "total_score": total_score,
+            "current_rank": self.format_rank_display(total_score),
+            "rank_progress": rank_info['progress_percent'],
+            "progress_bar": progress_bar,
+            "total_attempts": total_attempts,
+            "successful_attempts": successful_attempts,
+            "success_rate": round(success_rate, 1),
+            "best_time": self.scores_data.get('best_time'),
+            "best_seed": self.scores_data.get('best_seed'),
+            "best_village_type": self.scores_data.get('best_village_type'),
+            "recent_scores": recent_scores,
+            "best_scores": best_scores
+        })
+        self.bump_state_version()
 
 
 # 创建Flask Web应用
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
+
+def versioned_json(system, name, key, build):
+    """按状态版本缓存序列化后的JSON响应并附带强ETag；If-None-Match 匹配时直接返回304"""
+    etag = '"{}-{}-{}"'.format(system.etag_prefix, name, "-".join(str(part) for part in key))
+    # 服务器时间不参与ETag，304也带上，页面用它校正本地时钟计算用时
+    server_time = '{:.3f}'.format(time.time())
+
+    # If-None-Match 使用弱比较，忽略 W/ 前缀
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags):
+            return Response(status=304, headers={'ETag': etag, 'X-Server-Time': server_time})
+
+    cached = system.response_cache.get(name)
+    if cached is None or cached[0] != etag:
+        cached = (etag, jsonify(build()).get_data())
+        system.response_cache[name] = cached
+
+    # no-cache: 浏览器每次都带 If-None-Match 回来验证
+    return Response(cached[1], mimetype='application/json',
+                    headers={'ETag': etag, 'Cache-Control': 'no-cache', 'X-Server-Time': server_time})
+
 # 全局FSG实例
 fsg_system = None
 
 
+class SessionManager:
+    """在一台主机上同时运行多个互相隔离的挑战实例，每位玩家一个实例"""
+
+    def __init__(self, primary, max_sessions=0, session_cores=1, session_memory_mb=1024, port_offset=10,
+                 base_port=0):
+        self.primary = primary
+        self.max_sessions = max_sessions
+        self.session_cores = session_cores
+        self.session_memory_mb = session_memory_mb
+        self.port_offset = port_offset
+        # 0: 从主服务器端口往后偏移 port_offset
+        self.base_port = base_port
+        self.sessions = {}
+        # 正在创建的实例: session_id -> {"slot", "done"}，复制服务器目录和构建实例时不持有锁
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def capacity(self):
+        """按CPU核心数和可用内存计算还能开多少个实例"""
+        limit = max(1, (os.cpu_count() or 1) // max(1, self.session_cores))
+        if self.max_sessions:
+            limit = min(limit, self.max_sessions)
+
+        free = limit - len(self.sessions) - len(self.pending)
+        available = available_memory_bytes()
+        if available is not None and self.session_memory_mb:
+            free = min(free, available // (self.session_memory_mb * 1024 * 1024))
+        return limit, max(0, int(free))
+
+    @staticmethod
+    def make_id(player):
+        return re.sub(r"[^\w\-]", "_", str(player))[:32]
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def create(self, player):
+        """为玩家创建实例；已存在时直接返回，超过容量时返回None"""
+        session_id = self.make_id(player)
+        if not session_id:
+            return None
+
+        with self.lock:
+            if session_id in self.sessions:
+                return self.sessions[session_id]
+            reservation = self.pending.get(session_id)
+            creating = reservation is None
+            if creating:
+                _, free = self.capacity()
+                if free <= 0:
+                    return None
+                used_slots = ({system.session_slot for system in self.sessions.values()}
+                              | {pending["slot"] for pending in self.pending.values()})
+                slot = next(i for i in itertools.count() if i not in used_slots)
+                reservation = self.pending[session_id] = {"slot": slot, "done": threading.Event()}
+
+        if not creating:
+            # 同一玩家的实例正在由另一个请求创建
+            reservation["done"].wait()
+            return self.get(session_id)
+
+        system = None
+        try:
+            primary_dir = self.primary.server_dirs[0]
+            server_dir = f"{primary_dir}_s{slot}"
+            if self.base_port:
+                port = self.base_port + slot * 2
+            else:
+                port = (self.primary.get_server_port(os.path.join(primary_dir, "server.properties"))
+                        + self.port_offset + slot * 2)
+
+            self.primary.kill_stray_servers = False
+            self.primary._ensure_server_copy(server_dir, port)
+            # 已有的实例目录可能是其他端口配置下创建的，每次都重写端口
+            write_server_properties(os.path.join(server_dir, "server.properties"),
+                                    {"server-port": str(port), "server-portv6": str(port + 1)})
+            system = FSGSystem(session_id, server_dir,
+                               os.path.join(self.primary.state_dir, f"fsg_scores_{session_id}.json"),
+                               shared=self.primary, state_dir=self.primary.state_dir)
+            system.session_slot = slot
+            system.player = str(player)
+        finally:
+            with self.lock:
+                del self.pending[session_id]
+                if system is not None:
+                    self.sessions[session_id] = system
+            reservation["done"].set()
+
+        self.primary.add_message(f"已为玩家 {player} 创建实例 {session_id}（端口 {port}）")
+        return system
+
+    def remove(self, session_id):
+        with self.lock:
+            system = self.sessions.pop(session_id, None)
+        if system:
+            system.close()
+        return system is not None
+
+    def list(self):
+        with self.lock:
+            systems = list(self.sessions.items())
+        return [{
+            "id": session_id,
+            "player": system.player,
+            "port": system.get_server_port(),
+            "status": system.get_status()
+        } for session_id, system in systems]
+
+
+def http_json(url, payload=None, method=None, timeout=5):
+    """发送JSON请求并解析JSON响应，失败时抛出OSError或ValueError"""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method or ("POST" if data is not None else "GET"),
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8") or "null")
+    except urllib.error.HTTPError as e:
+        # 代理端的业务错误（如容量已满）同样返回JSON
+        body = e.read().decode("utf-8", "replace")
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise OSError(f"HTTP {e.code}: {body[:200]}")
+
+
+class ClusterStore:
+    """协调端成绩库: SQLite的WAL模式，记录每位玩家所在的代理实例、同步进度和从代理拉取的原始记录"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS placements (
+                player TEXT PRIMARY KEY,
+                agent TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                port INTEGER,
+                synced INTEGER NOT NULL DEFAULT 0,
+                total_score REAL,
+                current_rank TEXT
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                player TEXT NOT NULL,
+                agent TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_player ON records(player);
+        """)
+
+    def placements(self):
+        """玩家 -> {"agent", "id", "port"}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT player, agent, session_id, port FROM placements").fetchall()
+        return {player: {"agent": agent, "id": session_id, "port": port} for player, agent, session_id, port in rows}
+
+    def set_placement(self, player, placement):
+        """记录玩家所在的代理实例；换了代理或实例时同步进度从头开始"""
+        with self.lock:
+            row = self.conn.execute("SELECT agent, session_id FROM placements WHERE player = ?",
+                                    (player,)).fetchone()
+            if row == (placement["agent"], placement["id"]):
+                self.conn.execute("UPDATE placements SET port = ? WHERE player = ?", (placement["port"], player))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO placements (player, agent, session_id, port, synced) VALUES (?, ?, ?, ?, 0)",
+                    (player, placement["agent"], placement["id"], placement["port"]))
+
+    def cursor(self, player, placement):
+        """该玩家在这个代理实例上已同步到的记录id，实例不符时为0"""
+        with self.lock:
+            row = self.conn.execute("SELECT synced, total_score FROM placements "
+                                    "WHERE player = ? AND agent = ? AND session_id = ?",
+                                    (player, placement["agent"], placement["id"])).fetchone()
+        return row if row else (0, None)
+
+    def add_records(self, player, placement, records, synced, total_score, current_rank):
+        """在一个事务里写入新记录并推进同步进度"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT INTO records (player, agent, record) VALUES (?, ?, ?)",
+                                      [(player, placement["agent"], json.dumps(r, ensure_ascii=False))
+                                       for r in records])
+                self.conn.execute("UPDATE placements SET synced = ?, total_score = ?, current_rank = ? "
+                                  "WHERE player = ? AND agent = ? AND session_id = ?",
+                                  (synced, total_score, current_rank, player, placement["agent"], placement["id"]))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def leaderboard(self):
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT p.player, COALESCE(p.total_score, 0), p.current_rank, p.agent,
+                       (SELECT COUNT(*) FROM records r WHERE r.player = p.player)
+                FROM placements p ORDER BY COALESCE(p.total_score, 0) DESC
+            """).fetchall()
+        return [{"player": player, "total_score": total_score, "current_rank": current_rank, "attempts": attempts,
+                 "agent": agent} for player, total_score, current_rank, agent, attempts in rows]
+
+
+class ClusterCoordinator:
+    """把挑战分派到其他主机上的代理进程，并把各代理的成绩汇总到中心成绩库"""
+
+    def __init__(self, agents, store_path, poll_interval=5):
+        self.agents = [agent.rstrip("/") for agent in agents]
+        self.store = ClusterStore(store_path)
+        self.poll_interval = poll_interval
+        # 玩家 -> {"agent", "id", "port"}
+        self.placements = self.store.placements()
+        self.lock = threading.Lock()
+
+    def agent_info(self, agent):
+        try:
+            info = http_json(f"{agent}/api/agent/info")
+            info["agent"] = agent
+            info["online"] = True
+            return info
+        except (OSError, ValueError) as e:
+            return {"agent": agent, "online": False, "error": str(e), "free": 0}
+
+    def agents_info(self):
+        """并行查询所有代理的剩余容量"""
+        results = [None] * len(self.agents)
+
+        def query(i, agent):
+            results[i] = self.agent_info(agent)
+
+        threads = [threading.Thread(target=query, args=(i, agent), daemon=True) for i, agent in enumerate(self.agents)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def dispatch(self, player, start_options=None):
+        """创建并启动挑战，返回 (放置信息, None) 或 (None, 失败原因)
+
+        玩家的累计成绩和段位保存在代理实例里，已分派过的玩家始终回到原来的代理；
+        新玩家选择剩余容量最多的代理。
+        """
+        with self.lock:
+            placement = self.placements.get(player)
+
+        if placement:
+            candidates = [placement["agent"]]
+        else:
+            infos = sorted((info for info in self.agents_info() if info["online"] and info["free"] > 0),
+                           key=lambda info: (-info["free"], info.get("load", 0)))
+            candidates = [info["agent"] for info in infos]
+        if not candidates:
+            return None, "没有可用的代理"
+
+        error = None
+        for agent in candidates:
+            try:
+                created = http_json(f"{agent}/api/sessions", {"player": player})
+                if not created or not created.get("success"):
+                    error = (created or {}).get("message") or f"代理 {agent} 无法创建实例"
+                    continue
+                started = http_json(f"{agent}/api/sessions/{created['id']}/start", start_options or {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"分派到代理 {agent} 失败: {e}")
+                error = f"代理 {agent} 不可用: {e}"
+                continue
+
+            if not started or not started.get("success"):
+                error = (started or {}).get("message") or "启动失败"
+                logger.warning(f"代理 {agent} 启动挑战失败: {error}")
+                if not placement:
+                    # 为新玩家临时创建的实例不保留，免得占用代理的容量
+                    try:
+                        http_json(f"{agent}/api/sessions/{created['id']}", method="DELETE")
+                    except (OSError, ValueError):
+                        pass
+                continue
+
+            new_placement = {"agent": agent, "id": created["id"], "port": created.get("port")}
+            self.store.set_placement(player, new_placement)
+            with self.lock:
+                self.placements[player] = new_placement
+            return dict(new_placement), None
+        return None, error
+
+    def proxy(self, player, path, payload=None, method=None):
+        """把请求转发到玩家所在的代理"""
+        with self.lock:
+            placement = self.placements.get(player)
+        if not placement:
+            return None
+        return http_json(f"{placement['agent']}/api/sessions/{placement['id']}{path}", payload, method)
+
+    def sync_once(self):
+        """从各代理拉取新的成绩记录并写入中心成绩库"""
+        with self.lock:
+            placements = dict(self.placements)
+
+        for player, placement in placements.items():
+            synced, total_score = self.store.cursor(player, placement)
+            try:
+                result = http_json(f"{placement['agent']}/api/sessions/{placement['id']}/records?after={synced}")
+            except (OSError, ValueError):
+                continue
+            if not result or not result.get("records") and result.get("total_score") == total_score:
+                continue
+
+            for record in result.get("records", []):
+                record["agent"] = placement["agent"]
+            self.store.add_records(player, placement, result.get("records", []), result.get("count", synced),
+                                   result.get("total_score"), result.get("current_rank"))
+
+    def start_sync(self):
+        def sync_loop():
+            while True:
+                try:
+                    self.sync_once()
+                except Exception as e:
+                    logger.warning(f"同步代理成绩出错: {e}")
+                time.sleep(self.poll_interval)
+
+        threading.Thread(target=sync_loop, daemon=True).start()
+
+    def leaderboard(self):
+        return self.store.leaderboard()
+
+
+session_manager = None
+coordinator = None
+# 运行模式: "single" / "agent" / "coordinator"
+run_mode = "single"
+
+
+def get_session_manager():
+    """获取多实例管理器（单例模式）"""
+    global session_manager
+    if session_manager is None:
+        system = get_fsg_system()
+        session_manager = SessionManager(system, system.max_sessions, system.session_cores,
+                                         system.session_memory_mb, base_port=system.session_base_port)
+    return session_manager
+
+
 def get_fsg_system():
     """获取FSG系统实例（单例模式）"""
     global fsg_system
@@ -1513,6 +4940,11 @@ HTML_TEMPLATE = '''
                     <div class="status-label">掉率设置</div>
                     <div class="status-value" id="dropRateSetting">正常</div>
                 </div>
+
+                <div class="status-item">
+                    <div class="status-label">服务器端口</div>
+                    <div class="status-value" id="serverPort">-</div>
+                </div>
             </div>
 
             <div class="status-item">
@@ -1582,14 +5014,67 @@ HTML_TEMPLATE = '''
     <script>
         let currentSession = null;
         let refreshInterval = null;
+        let lastMessageId = null;
+        let eventSource = null;
+        let statusReceivedAt = 0;
+        let lastServerPort = null;
+        let serverId = null;
+        // 服务器时钟 - 本地时钟（毫秒），用于按 started_at 计算用时
+        let clockOffset = 0;
 
         // 页面加载时初始化
         document.addEventListener('DOMContentLoaded', function() {
-            refreshStatus();
-            refreshMessages();
-            startAutoRefresh();
+            if (window.EventSource) {
+                connectEvents();
+            } else {
+                refreshStatus();
+                refreshMessages();
+                startAutoRefresh();
+            }
+            // 本地走表，不需要每秒请求服务器
+            setInterval(tickElapsed, 1000);
         });
 
+        // 订阅服务器推送，连接彻底失败时退回轮询
+        function connectEvents() {
+            eventSource = new EventSource('/api/events');
+
+            eventSource.onopen = () => {
+                if (refreshInterval) {
+                    clearInterval(refreshInterval);
+                    refreshInterval = null;
+                }
+            };
+            eventSource.addEventListener('status', e => updateStatusDisplay(JSON.parse(e.data)));
+            eventSource.addEventListener('message', e => appendMessages([JSON.parse(e.data)]));
+            eventSource.addEventListener('countdown', e => {
+                const data = JSON.parse(e.data);
+                document.getElementById('currentStatus').textContent = `挑战完成，服务器将在 ${data.remaining} 秒后关闭`;
+            });
+            eventSource.addEventListener('settlement', () => refreshStatus());
+            eventSource.onerror = () => {
+                // 浏览器会自动重连；只有连接被关闭时才改为轮询
+                if (eventSource.readyState === EventSource.CLOSED) {
+                    eventSource = null;
+                    startAutoRefresh();
+                }
+            };
+        }
+
+        function sessionElapsed(session) {
+            if (session.started_at) {
+                return Math.max(0, Math.floor((Date.now() + clockOffset) / 1000 - session.started_at));
+            }
+            return session.elapsed_seconds + Math.floor((Date.now() - statusReceivedAt) / 1000);
+        }
+
+        function tickElapsed() {
+            if (!currentSession) return;
+            const elapsed = sessionElapsed(currentSession);
+            document.getElementById('elapsedTime').textContent =
+                `${Math.floor(elapsed / 60).toString().padStart(2, '0')}:${(elapsed % 60).toString().padStart(2, '0')}`;
+        }
+
         // 自动刷新状态和消息
         function startAutoRefresh() {
             if (refreshInterval) clearInterval(refreshInterval);
@@ -1604,6 +5089,8 @@ HTML_TEMPLATE = '''
             try {
                 const response = await fetch('/api/status');
                 const data = await response.json();
+                const serverTime = parseFloat(response.headers.get('X-Server-Time'));
+                if (!isNaN(serverTime)) clockOffset = serverTime * 1000 - Date.now();
 
                 updateStatusDisplay(data);
 
@@ -1615,6 +5102,14 @@ HTML_TEMPLATE = '''
 
         // 更新状态显示
         function updateStatusDisplay(data) {
+            // 服务端重启后消息id从头开始，清空消息列表重新加载
+            if (data.server_id && serverId !== null && data.server_id !== serverId) {
+                lastMessageId = null;
+                document.getElementById('messagesContainer').innerHTML = '';
+            }
+            serverId = data.server_id || serverId;
+            if (data.server_time) clockOffset = data.server_time * 1000 - Date.now();
+
             const statusElement = document.getElementById('currentStatus');
             const activeSessionInfo = document.getElementById('activeSessionInfo');
             const cancelButton = document.getElementById('cancelButton');
@@ -1626,10 +5121,20 @@ HTML_TEMPLATE = '''
                 // 更新会话信息
                 document.getElementById('currentSeed').textContent = data.seed;
                 document.getElementById('villageType').textContent = data.village_type;
+                const elapsed = sessionElapsed(data);
                 document.getElementById('elapsedTime').textContent = 
-                    `${Math.floor(data.elapsed_seconds / 60).toString().padStart(2, '0')}:${(data.elapsed_seconds % 60).toString().padStart(2, '0')}`;
+                    `${Math.floor(elapsed / 60).toString().padStart(2, '0')}:${(elapsed % 60).toString().padStart(2, '0')}`;
                 document.getElementById('dropRateSetting').textContent = 
-                    data.increased_drop_rate ? '增加掉率' : '正常掉率';
+                    data.drop_rate_tier && data.drop_rate_tier !== 'normal' ? `掉率增加(${data.drop_rate_tier})` : '正常掉率';
+
+                // 接管预热服务器后端口可能变化，需要提醒玩家改连
+                const portElement = document.getElementById('serverPort');
+                const portChanged = lastServerPort !== null && data.server_port !== lastServerPort;
+                if (!currentSession || currentSession.seed !== data.seed) {
+                    portElement.textContent = portChanged ? `${data.server_port}（端口已变更，请改连）` : data.server_port;
+                    portElement.style.color = portChanged ? '#f5576c' : '';
+                    lastServerPort = data.server_port;
+                }
 
                 // 禁用开始按钮，启用取消按钮
                 document.getElementById('startButton').disabled = true;
@@ -1637,6 +5142,7 @@ HTML_TEMPLATE = '''
                 document.getElementById('dropRateButtons').style.display = 'none';
 
                 currentSession = data;
+                statusReceivedAt = Date.now();
 
             } else {
                 statusElement.textContent = data.message || '空闲';
@@ -1660,41 +5166,72 @@ HTML_TEMPLATE = '''
         // 刷新消息
         async function refreshMessages() {
             try {
-                const response = await fetch('/api/messages');
+                const url = lastMessageId === null ? '/api/messages' : `/api/messages?after=${lastMessageId}`;
+                const response = await fetch(url);
+                if (response.status === 204) return;
                 const messages = await response.json();
 
                 const container = document.getElementById('messagesContainer');
-                container.innerHTML = '';
+
+                // 首次加载时整体重绘，之后只追加新消息
+                if (lastMessageId === null) {
+                    container.innerHTML = '';
+                }
 
                 if (messages.length === 0) {
-                    container.innerHTML = '<div class="message">暂无消息</div>';
+                    if (!container.children.length) {
+                        container.innerHTML = '<div class="message message-empty">暂无消息</div>';
+                    }
+                    lastMessageId = lastMessageId || 0;
                     return;
                 }
 
-                messages.forEach(msg => {
-                    const messageDiv = document.createElement('div');
-                    messageDiv.className = 'message';
+                appendMessages(messages);
 
-                    if (msg.type === 'error') {
-                        messageDiv.classList.add('message-error');
-                    } else if (msg.type === 'success') {
-                        messageDiv.classList.add('message-success');
-                    }
+            } catch (error) {
+                console.error('刷新消息失败:', error);
+            }
+        }
 
-                    messageDiv.innerHTML = `
-                        <span class="message-time">${msg.time}</span>
-                        ${msg.message}
-                    `;
+        // 追加消息到消息列表
+        function appendMessages(messages) {
+            const container = document.getElementById('messagesContainer');
+            // 重连补发或轮询重叠时可能收到已显示过的消息，直接跳过
+            if (lastMessageId !== null) {
+                messages = messages.filter(msg => msg.id > lastMessageId);
+            }
+            if (messages.length === 0) return;
 
-                    container.appendChild(messageDiv);
-                });
+            const placeholder = container.querySelector('.message-empty');
+            if (placeholder) placeholder.remove();
+            lastMessageId = messages[messages.length - 1].id;
 
-                // 滚动到底部
-                container.scrollTop = container.scrollHeight;
+            messages.forEach(msg => {
+                const messageDiv = document.createElement('div');
+                messageDiv.className = 'message';
 
-            } catch (error) {
-                console.error('刷新消息失败:', error);
+                if (msg.type === 'error') {
+                    messageDiv.classList.add('message-error');
+                } else if (msg.type === 'success') {
+                    messageDiv.classList.add('message-success');
+                }
+
+                messageDiv.innerHTML = `
+                    <span class="message-time">${msg.time}</span>
+                    ${msg.message}
+                `;
+
+                container.appendChild(messageDiv);
+            });
+
+            // 页面上最多保留100条
+            while (container.children.length > 100) {
+                container.removeChild(container.firstChild);
             }
+
+            // 滚动到底部
+            container.scrollTop = container.scrollHeight;
+
         }
 
         // 显示掉率选择按钮
@@ -1877,32 +5414,23 @@ def index():
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
-    """获取当前状态"""
+    """获取当前状态（状态未变化时返回304）"""
     system = get_fsg_system()
-    status = system.get_status()
-
-    # 添加段位信息
-    current_score = system.scores_data.get('total_score', 0)
-    rank_info = system.get_rank_info(current_score)
-
-    status['rank_info'] = {
-        'current_rank': system.format_rank_display(current_score),
-        'rank_progress': rank_info['progress_percent'],
-        'total_score': current_score
-    }
-
-    return jsonify(status)
+    return versioned_json(system, "status", system.status_cache_key(), system.status_payload)
 
 
 @app.route('/api/start', methods=['POST'])
 def api_start():
     """开始新的FSG挑战"""
+    if run_mode == "agent":
+        return jsonify({'success': False, 'message': '代理模式下只接受协调端分派的挑战（/api/sessions）'}), 409
     system = get_fsg_system()
 
     data = request.get_json()
     increased_drop_rate = data.get('increased_drop_rate', False) if data else False
+    drop_rate_tier = data.get('drop_rate_tier') if data else None
 
-    success = system.start_fsg(increased_drop_rate)
+    success = system.start_fsg(increased_drop_rate, drop_rate_tier)
 
     return jsonify({
         'success': success,
@@ -1935,20 +5463,285 @@ def api_cancel():
 
 @app.route('/api/scores', methods=['GET'])
 def api_scores():
-    """获取排行榜"""
+    """获取排行榜（成绩未变化时返回304）"""
     system = get_fsg_system()
-    scores = system.show_scores()
-    return jsonify(scores)
+    system.refresh_scores_snapshot()
+    return versioned_json(system, "scores", (system.state_version,), lambda: dict(system.scores_snapshot))
 
 
 @app.route('/api/messages', methods=['GET'])
 def api_messages():
-    """获取最近消息"""
+    """获取消息；带 after 参数时只返回更新的消息，没有新消息时返回204"""
+    system = get_fsg_system()
+    after = request.args.get('after', type=int)
+    if after is None:
+        return jsonify(system.get_messages(20))
+
+    messages = system.get_messages_after(after)
+    if not messages:
+        return '', 204
+    return jsonify(messages)
+
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """SSE推送: 状态变化、新消息、检测与结算结果、关闭倒计时"""
+    system = get_fsg_system()
+    subscriber = system.events.subscribe()
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    def format_event(event, data, event_id=None):
+        lines = [f"event: {event}"]
+        if event_id is not None:
+            lines.append(f"id: {event_id}")
+        lines.append("data: " + json.dumps(data, ensure_ascii=False))
+        return "\n".join(lines) + "\n\n"
+
+    def stream():
+        try:
+            # 断线重连时补发错过的消息，否则先发最近的消息
+            yield "retry: 3000\n\n"
+            yield format_event("status", dict(system.status_payload(), server_time=time.time()))
+            backlog = (system.get_messages_after(last_event_id) if last_event_id is not None
+                       else system.get_messages(20))
+            for entry in backlog:
+                yield format_event("message", entry, entry["id"])
+            # 订阅之后、读取补发消息之前产生的消息会同时出现在补发和队列里，队列中的跳过
+            last_sent_id = backlog[-1]["id"] if backlog else 0
+
+            while not subscriber.closed:
+                try:
+                    item = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # 心跳，防止代理和手机网络断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                if item is None or subscriber.closed:
+                    return
+                event, data, event_id = item
+                if event == "message" and event_id <= last_sent_id:
+                    continue
+                if event == "status":
+                    system.events.take_notice(subscriber, "status")
+                    data = dict(system.shared_status_payload(), server_time=time.time())
+                yield format_event(event, data, event_id)
+        finally:
+            system.events.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/server-log', methods=['GET'])
+def api_server_log():
+    """获取服务器控制台输出"""
+    system = get_fsg_system()
+    since = request.args.get('since', 0, type=int)
+    return jsonify({
+        'lines': system.server_output.get_lines(since),
+        'last_id': system.server_output.last_id()
+    })
+
+
+@app.route('/api/profile-seeds', methods=['GET', 'POST', 'DELETE'])
+def api_profile_seeds():
+    """启动、取消或查看种子性能测量"""
     system = get_fsg_system()
-    messages = system.get_messages(20)
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        success = system.profile_seeds(data.get('limit'), data.get('only_missing', True))
+        return jsonify({'success': success, 'progress': system.seed_profile_progress})
+    if request.method == 'DELETE':
+        system.cancel_seed_profiling()
+    return jsonify({
+        'running': system.seed_profiler is not None,
+        'progress': system.seed_profile_progress
+    })
+
+
+@app.route('/api/sessions', methods=['GET', 'POST'])
+def api_sessions():
+    """列出或创建多实例挑战"""
+    manager = get_session_manager()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        player = data.get('player')
+        if not player:
+            return jsonify({'success': False, 'message': '缺少玩家名'}), 400
+        system = manager.create(player)
+        if not system:
+            return jsonify({'success': False, 'message': '主机已达到实例上限'}), 503
+        return jsonify({'success': True, 'id': system.instance_id, 'port': system.get_server_port()})
+
+    limit, free = manager.capacity()
+    return jsonify({'sessions': manager.list(), 'limit': limit, 'free': free})
+
+
+def _session_or_404(session_id):
+    system = get_session_manager().get(session_id)
+    if not system:
+        return None, (jsonify({'success': False, 'message': '实例不存在'}), 404)
+    return system, None
+
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def api_session(session_id):
+    """查看或关闭一个实例"""
+    if request.method == 'DELETE':
+        return jsonify({'success': get_session_manager().remove(session_id)})
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    return jsonify(system.get_status())
+
+
+@app.route('/api/sessions/<session_id>/start', methods=['POST'])
+def api_session_start(session_id):
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    success = system.start_fsg(data.get('increased_drop_rate', False), data.get('drop_rate_tier'))
+    return jsonify({'success': success, 'message': 'FSG挑战已启动' if success else '启动失败'})
+
+
+@app.route('/api/sessions/<session_id>/cancel', methods=['POST'])
+def api_session_cancel(session_id):
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    result = system.cancel_fsg(data.get('confirmed', False))
+    if result == "need_confirmation":
+        return jsonify({'success': False, 'need_confirmation': True, 'message': '金以上段位需要确认取消'})
+    return jsonify({'success': result, 'message': 'FSG挑战已取消' if result else '取消失败'})
+
+
+@app.route('/api/sessions/<session_id>/scores', methods=['GET'])
+def api_session_scores(session_id):
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    return jsonify(system.show_scores())
+
+
+@app.route('/api/sessions/<session_id>/messages', methods=['GET'])
+def api_session_messages(session_id):
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    after = request.args.get('after', type=int)
+    if after is None:
+        return jsonify(system.get_messages())
+    messages = system.get_messages_after(after)
+    if not messages:
+        return '', 204
     return jsonify(messages)
 
 
+@app.route('/api/sessions/<session_id>/records', methods=['GET'])
+def api_session_records(session_id):
+    """供协调端增量拉取原始成绩记录"""
+    system, error = _session_or_404(session_id)
+    if error:
+        return error
+    after = request.args.get('after', 0, type=int)
+    records, cursor, _ = system.score_store.attempts(after)
+    total_score = system.scores_snapshot["total_score"]
+    return jsonify({
+        'records': records,
+        'count': cursor,
+        'total_score': total_score,
+        'current_rank': system.format_rank_display(total_score)
+    })
+
+
+@app.route('/api/agent/info', methods=['GET'])
+def api_agent_info():
+    """代理端报告剩余容量"""
+    if run_mode != "agent":
+        return jsonify({'success': False, 'message': '当前不是代理模式'}), 404
+    manager = get_session_manager()
+    limit, free = manager.capacity()
+    info = {'limit': limit, 'free': free, 'sessions': len(manager.sessions), 'cpu_count': os.cpu_count()}
+    if hasattr(os, 'getloadavg'):
+        info['load'] = os.getloadavg()[0]
+    return jsonify(info)
+
+
+def _coordinator_or_404():
+    if coordinator is None:
+        return jsonify({'success': False, 'message': '当前不是协调端模式'}), 404
+    return None
+
+
+@app.route('/api/cluster', methods=['GET'])
+def api_cluster():
+    """查看各代理状态和挑战分布"""
+    error = _coordinator_or_404()
+    if error:
+        return error
+    with coordinator.lock:
+        placements = dict(coordinator.placements)
+    return jsonify({'agents': coordinator.agents_info(), 'placements': placements})
+
+
+@app.route('/api/cluster/sessions', methods=['POST'])
+def api_cluster_dispatch():
+    """把一位玩家的挑战分派到负载最低的代理"""
+    error = _coordinator_or_404()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    player = data.get('player')
+    if not player:
+        return jsonify({'success': False, 'message': '缺少玩家名'}), 400
+    placement, message = coordinator.dispatch(player, {'increased_drop_rate': data.get('increased_drop_rate', False),
+                                                       'drop_rate_tier': data.get('drop_rate_tier')})
+    if not placement:
+        return jsonify({'success': False, 'message': message}), 503
+    return jsonify({'success': True, **placement})
+
+
+@app.route('/api/cluster/sessions/<player>', methods=['GET'])
+def api_cluster_session(player):
+    error = _coordinator_or_404()
+    if error:
+        return error
+    try:
+        status = coordinator.proxy(player, '')
+    except (OSError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'代理不可用: {e}'}), 502
+    if status is None:
+        return jsonify({'success': False, 'message': '实例不存在'}), 404
+    return jsonify(status)
+
+
+@app.route('/api/cluster/sessions/<player>/cancel', methods=['POST'])
+def api_cluster_cancel(player):
+    error = _coordinator_or_404()
+    if error:
+        return error
+    try:
+        result = coordinator.proxy(player, '/cancel', request.get_json(silent=True) or {})
+    except (OSError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'代理不可用: {e}'}), 502
+    if result is None:
+        return jsonify({'success': False, 'message': '实例不存在'}), 404
+    return jsonify(result)
+
+
+@app.route('/api/cluster/scores', methods=['GET'])
+def api_cluster_scores():
+    """中心成绩库排行榜"""
+    error = _coordinator_or_404()
+    if error:
+        return error
+    return jsonify(coordinator.leaderboard())
+
+
 @app.route('/api/health', methods=['GET'])
 def api_health():
     """健康检查"""
@@ -1956,8 +5749,42 @@ def api_health():
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FSG手机控制端")
+    parser.add_argument("--mode", choices=["single", "agent", "coordinator"], default="single",
+                        help="single: 单机; agent: 接受协调端分派的代理; coordinator: 把挑战分派给代理")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--server-dir", default=None, help="bedrock服务器目录，同一主机运行多个代理时需各不相同")
+    parser.add_argument("--state-dir", default=None,
+                        help="成绩、发牌进度、缓存的存放目录；代理模式默认为 agent_<端口>")
+    parser.add_argument("--game-port", type=int, default=None,
+                        help="实例服务器端口的起点（每个实例占两个端口），同一主机上的多个代理需错开")
+    parser.add_argument("--agents", nargs="*", default=None, help="协调端使用的代理地址，如 http://127.0.0.1:5001")
+    args = parser.parse_args()
+
+    run_mode = args.mode
+    state_dir = args.state_dir
+    if run_mode == "agent" and state_dir is None:
+        state_dir = f"agent_{args.port}"
+
     # 初始化FSG系统
-    fsg_system = FSGSystem()
+    fsg_system = FSGSystem(server_dir=args.server_dir, state_dir=state_dir)
+    if args.game_port:
+        fsg_system.session_base_port = args.game_port
+
+    if run_mode == "agent":
+        # 同一主机上的代理若都从主服务器端口往后排，实例端口会互相冲突
+        if not fsg_system.session_base_port:
+            parser.error("代理模式需要用 --game-port 或配置项 session_base_port 指定实例端口起点")
+        # 代理只运行协调端分派的实例，主服务器不开局，也不需要预热
+        fsg_system.prewarm_next_server = False
+        fsg_system.add_message(f"代理模式，状态目录: {state_dir}，实例端口起点: {fsg_system.session_base_port}")
+
+    if args.mode == "coordinator":
+        agents = args.agents if args.agents is not None else fsg_system.config.get("cluster_agents", [])
+        coordinator = ClusterCoordinator(agents, os.path.join(fsg_system.state_dir, "fsg_cluster_scores.db"),
+                                         fsg_system.config.get("cluster_poll_interval", 5))
+        coordinator.start_sync()
+        fsg_system.add_message(f"协调端模式，代理: {', '.join(coordinator.agents) or '无'}")
 
     # 启动Flask应用
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
\ No newline at end of file